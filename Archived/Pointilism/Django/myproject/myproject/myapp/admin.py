@@ -3,6 +3,7 @@ from django.contrib import admin
 # Register your models here.
 from myproject.myapp.models import Document
 from myproject.myapp.models import User
+from myproject.myapp.models import RenderJob
 
 admin.site.register(User)
 
@@ -14,3 +15,12 @@ class DocumentAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Document, DocumentAdmin)
+
+
+class RenderJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "kind", "setting", "status", "created",
+                    "updated")
+    list_filter = ["status", "kind"]
+
+
+admin.site.register(RenderJob, RenderJobAdmin)
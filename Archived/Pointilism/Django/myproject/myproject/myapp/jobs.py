@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+Render job queue. Views enqueue a RenderJob and return right away, the
+render runs on a local process pool, and the result Document is attached
+when it finishes. Identical (image, kind, setting) submissions share one
+render while it is in flight in this process, and reuse the stored result
+once any process has finished it. Futures only live in the process that
+submitted them, which keeps their queued jobs fresh with a heartbeat, so
+a job left queued by a restart is failed once it goes stale.
+"""
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from myproject.myapp.models import Document, RenderJob
+from myproject.myapp.pointillism import pointillize, pointillizeStack
+from PIL import Image, ImageOps
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from functools import partial
+import hashlib
+import io
+import os
+import threading
+import time
+
+_executor = None
+_in_flight = {}  # key -> future of the render
+_lock = threading.RLock()  # callbacks may run while it is held
+
+
+def get_executor():
+    """Returns the process pool, started on first use with
+    settings.RENDER_WORKERS workers (default one per core), along with
+    the heartbeat thread of its jobs"""
+
+    global _executor
+    with _lock:
+        if _executor is None:
+            workers = getattr(settings, 'RENDER_WORKERS', None)
+            _executor = ProcessPoolExecutor(workers or os.cpu_count())
+            threading.Thread(target=_heartbeat, daemon=True).start()
+    return _executor
+
+
+def job_timeout():
+    """Returns seconds after which a queued job that has not been updated
+    is stale, settings.RENDER_JOB_TIMEOUT (default 600)"""
+
+    return getattr(settings, 'RENDER_JOB_TIMEOUT', 600)
+
+
+def _heartbeat():
+    """Refreshes updated on the queued jobs of the renders in flight in
+    this process every third of job_timeout(), so that other processes
+    do not expire them while they wait in a backed-up pool"""
+
+    while True:
+        time.sleep(job_timeout() / 3)
+        with _lock:
+            keys = list(_in_flight)
+        if not keys:
+            continue
+        try:
+            (RenderJob.objects.filter(status=RenderJob.QUEUED, key__in=keys)
+             .update(updated=timezone.now()))
+        except DatabaseError:
+            pass  # try again on the next beat
+        finally:
+            connection.close()
+
+
+def expire_stale_jobs(jobs):
+    """Fails the queued jobs of queryset jobs that are not in flight here
+    and have not been updated for job_timeout() seconds. Jobs in flight
+    in any live process are kept fresh by its heartbeat, so these had
+    their render lost. Returns the number failed"""
+
+    timeout = job_timeout()
+    now = timezone.now()
+    with _lock:
+        in_flight = list(_in_flight)
+    return (jobs.filter(status=RenderJob.QUEUED,
+                        updated__lt=now - timedelta(seconds=timeout))
+            .exclude(key__in=in_flight)
+            .update(status=RenderJob.FAILED, updated=now,
+                    error='Timed out: the render was lost, please retry'))
+
+
+def job_key(data, kind, setting):
+    """Returns dedupe key of a render of image bytes data"""
+
+    digest = hashlib.sha256(data)
+    digest.update(('\0%s\0%s' % (kind, setting)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def make_thumbnail(image, size=600):
+    """Returns JPEG bytes of image center-cropped to size x size"""
+
+    out = io.BytesIO()
+    ImageOps.fit(image.convert('RGB'), (size, size), Image.LANCZOS).save(
+        out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+def preview_name(key):
+    """Returns storage name of the progressive preview of render key"""
+
+    return 'previews/%s.jpg' % key
+
+
+def save_preview(name, image):
+    """Stores image as JPEG under name, replacing any earlier preview"""
+
+    out = io.BytesIO()
+    image.convert('RGB').save(out, 'JPEG', quality=70)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, ContentFile(out.getvalue()))
+
+
+def render_image(data, setting, image_format, key=None):
+    """Pointillizes image bytes with setting, returning encoded bytes and
+    thumbnail bytes. If key is given, low resolution previews are stored
+    under preview_name(key) while it renders"""
+
+    point = pointillize(image=Image.open(io.BytesIO(data)), reduce_factor=2,
+                        renderer='numpy', draft_size=2200)
+    point.resize(ratio=0, min_size=2200)
+    progress = None
+    if key is not None:
+        progress = partial(save_preview, preview_name(key))
+    point.plot(setting, progress=progress)
+    out = io.BytesIO()
+    point.out.convert('RGB').save(out, image_format)
+    return out.getvalue(), make_thumbnail(point.out)
+
+
+def render_gif(data):
+    """Renders the multiplier gif of image bytes, returning gif bytes and
+    no thumbnail, as the gif is already small"""
+
+    point = pointillizeStack(image=Image.open(io.BytesIO(data)),
+                             reduce_factor=2, border=0, queue=True,
+                             draft_size=550)
+    point.resize(0, 550)
+    point.plot('balanced')
+    multipliers = [5, 4.5, 4, 3.5, 3, 2.6, 2.3, 2, 1.75,
+                   1.5, 1.25, 1.1, 1, 1]
+    multipliers.reverse()
+    point.build_multipliers(multipliers, reverse=True, lazy=True)
+    out = io.BytesIO()
+    point.save_gif(out, 0.1)
+    return out.getvalue(), None
+
+
+def enqueue(user, source, data, kind, setting, name, image_format='JPEG'):
+    """Creates a RenderJob of kind 'image' or 'gif' for user from image
+    bytes data (uploaded as Document source), starts it and returns it.
+    The result is saved as a Document named name"""
+
+    key = job_key(data, kind, setting)
+    job = user.renderjob_set.create(source=source, kind=kind,
+                                    setting=setting, key=key)
+
+    # Reuse a finished render of the same image and setting
+    done = (RenderJob.objects.filter(key=key, status=RenderJob.DONE,
+                                     result__isnull=False)
+            .select_related('result').first())
+    if done is not None:
+        job.result = user.document_set.create(
+            docfile=done.result.docfile.name,
+            thumbnail=done.result.thumbnail.name, kind=done.result.kind,
+            is_render=True)
+        job.status = RenderJob.DONE
+        job.save()
+        return job
+
+    # Or wait on the same render if it is in flight, else submit one
+    with _lock:
+        future = _in_flight.get(key)
+        if future is None:
+            if kind == 'gif':
+                future = get_executor().submit(render_gif, data)
+            else:
+                future = get_executor().submit(render_image, data, setting,
+                                               image_format, key)
+            _in_flight[key] = future
+            future.add_done_callback(partial(_forget, key))
+    future.add_done_callback(partial(_complete, job.pk, name,
+                                     threading.get_ident()))
+    return job
+
+
+def _forget(key, future):
+    with _lock:
+        if _in_flight.get(key) is future:
+            del _in_flight[key]
+    try:
+        default_storage.delete(preview_name(key))
+    except OSError:
+        pass
+
+
+def _complete(job_pk, name, caller, future):
+    """Attaches the rendered Document to job, or records the error. When
+    run on the pool's callback thread rather than the caller's, closes
+    that thread's database connection"""
+
+    try:
+        job = RenderJob.objects.select_related('user').get(pk=job_pk)
+        try:
+            data, thumbnail = future.result()
+        except Exception as e:
+            job.status = RenderJob.FAILED
+            job.error = '%s: %s' % (type(e).__name__, e)
+        else:
+            document = Document(user=job.user, kind=job.kind, is_render=True,
+                                docfile=ContentFile(data, name=name))
+            if thumbnail is not None:
+                document.thumbnail = ContentFile(
+                    thumbnail, name=name.rsplit('.', 1)[0] + ' thumb.jpg')
+            document.save()
+            job.result = document
+            job.status = RenderJob.DONE
+        job.save()
+    finally:
+        if threading.get_ident() != caller:
+            connection.close()
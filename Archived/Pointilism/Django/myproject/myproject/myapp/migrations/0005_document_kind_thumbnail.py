@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+import myproject.myapp.models
+
+
+def set_kinds(apps, schema_editor):
+    """Marks existing renders, which were only told apart by file name"""
+
+    Document = apps.get_model('myapp', 'Document')
+    Document.objects.filter(docfile__endswith='pointillized.jpg').update(
+        kind='image', is_render=True)
+    Document.objects.filter(docfile__endswith='pointillized.gif').update(
+        kind='gif', is_render=True)
+    Document.objects.filter(docfile__iendswith='.gif',
+                            is_render=False).update(kind='gif')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0004_renderjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='thumbnail',
+            field=models.FileField(blank=True, upload_to=myproject.myapp.models.get_upload_dir),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='kind',
+            field=models.CharField(choices=[('image', 'Image'), ('gif', 'Gif')], default='image', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='is_render',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['user', 'kind', 'is_render', '-id'], name='myapp_doc_user_kind_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['gallery', 'is_render', 'kind', '-id'], name='myapp_doc_gallery_idx'),
+        ),
+        migrations.RunPython(set_kinds, migrations.RunPython.noop),
+    ]
@@ -15,9 +15,26 @@ def get_upload_dir(instance, filename):
 
 
 class Document(models.Model):
+    IMAGE = 'image'
+    GIF = 'gif'
+    KIND_CHOICES = ((IMAGE, 'Image'), (GIF, 'Gif'))
+
     user = models.ForeignKey(User, default=999, on_delete=models.CASCADE)
     docfile = models.FileField(upload_to=get_upload_dir)
+    thumbnail = models.FileField(upload_to=get_upload_dir, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES,
+                            default=IMAGE)
+    is_render = models.BooleanField(default=False)
     gallery = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'kind', 'is_render', '-id'],
+                         name='myapp_doc_user_kind_idx'),
+            models.Index(fields=['gallery', 'is_render', 'kind', '-id'],
+                         name='myapp_doc_gallery_idx'),
+        ]
 
     def image_img(self):
                 if self.docfile:
@@ -25,4 +42,24 @@ class Document(models.Model):
                 else:
                     return '(No image found)'
     image_img.short_description = 'Thumb'
-    image_img.allow_tags = True
\ No newline at end of file
+    image_img.allow_tags = True
+
+class RenderJob(models.Model):
+    QUEUED = 'queued'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = ((QUEUED, 'Queued'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    source = models.ForeignKey(Document, null=True, blank=True,
+                               on_delete=models.SET_NULL, related_name='+')
+    result = models.ForeignKey(Document, null=True, blank=True,
+                               on_delete=models.SET_NULL, related_name='+')
+    kind = models.CharField(max_length=10)
+    setting = models.CharField(max_length=20, blank=True)
+    key = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=QUEUED, db_index=True)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
@@ -5,16 +5,104 @@ This module contains classes that help create pointillized images.
 """
 
 import numpy as np
-from PIL import Image, ImageDraw, ExifTags, ImageEnhance
+from PIL import Image, ImageChops, ImageDraw, ExifTags, ImageEnhance
 #from scipy import ndimage
-import imageio
-from IPython.display import display
-from random import random
+import io
+import math
 import os
 import time
 import inspect
+import hashlib
+import json
+import struct
+import zlib
+import sys
+from itertools import chain, islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from functools import lru_cache, partial
 #from matplotlib import pyplot as plt
 
+# imageio and IPython are slow to import and most renders need neither,
+# so they are imported where they are used. So is
+# multiprocessing.shared_memory, which only the process pool code needs
+# and which requires Python 3.8, so the app still loads on older Pythons
+
+# Compact record of one plotted point, used by the render cache
+point_dtype = np.dtype([('x', 'int32'), ('y', 'int32'), ('r', 'float64'),
+                        ('R', 'uint8'), ('G', 'uint8'), ('B', 'uint8'),
+                        ('alpha', 'uint8'), ('mask', 'bool')])
+
+
+class pointArray:
+    """Growable structured array of points (point_dtype), whose storage
+    doubles in size whenever it fills up"""
+
+    def __init__(self, capacity=1024):
+
+        self._data = np.empty(capacity, dtype=point_dtype)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def data(self):
+        """View of the points added so far"""
+
+        return self._data[:self.size]
+
+    def append(self, x, y, r, R, G, B, alpha=255, mask=False):
+        """Adds a point, doubling the storage if it is full"""
+
+        if self.size == len(self._data):
+            grown = np.empty(2 * len(self._data), dtype=point_dtype)
+            grown[:self.size] = self._data
+            self._data = grown
+        self._data[self.size] = (x, y, r, R, G, B, alpha, mask)
+        self.size += 1
+
+    def extend(self, points):
+        """Adds a structured array of points, growing the storage once"""
+
+        size = self.size + len(points)
+        if size > len(self._data):
+            grown = np.empty(max(2 * len(self._data), size),
+                             dtype=point_dtype)
+            grown[:self.size] = self.data
+            self._data = grown
+        self._data[self.size:size] = points
+        self.size = size
+
+    @classmethod
+    def fromarray(cls, points):
+        """Builds a pointArray holding a copy of structured array points"""
+
+        new = cls(max(len(points), 1))
+        new._data[:len(points)] = points
+        new.size = len(points)
+        return new
+
+    def save(self, location):
+        """Saves points to location, as .npz if it ends with that, or .npy"""
+
+        if location.endswith('.npz'):
+            np.savez_compressed(location, points=self.data)
+        else:
+            np.save(location, self.data)
+
+    @classmethod
+    def load(cls, location):
+        """Loads points saved with save()"""
+
+        if location.endswith('.npz'):
+            with np.load(location) as stored:
+                return cls.fromarray(stored['points'])
+        return cls.fromarray(np.load(location))
+
+
 # Base class definitions, handles files and image manipulations
 
 
@@ -32,70 +120,241 @@ class pointillize:
         self.point_queue = kwargs.get('queue', False)
         self.plot_coverage = kwargs.get('plot_coverage', True)
         self.use_coverage = kwargs.get('use_coverage', True)
+        self.renderer = kwargs.get('renderer', 'pil')
+        if self.renderer not in ['pil', 'numpy']:
+            raise ValueError('Invalid renderer argument')
+        self.kernel = kwargs.get('kernel', 'auto')
+        if self.kernel not in ['auto', 'numba', 'python']:
+            raise ValueError('Invalid kernel argument')
+        if (self.kernel == 'numba') and (_loadKernels() is None):
+            raise ImportError('kernel numba needs the numba package')
+
+        # Seedable random state, all point generation draws from self.rng.
+        # seed_seq can be spawned into independent streams for workers
+        self.seed = kwargs.get('seed', None)
+        if isinstance(self.seed, np.random.SeedSequence):
+            self.seed_seq = self.seed
+        else:
+            self.seed_seq = np.random.SeedSequence(self.seed)
+        self.rng = np.random.default_rng(self.seed_seq)
+        self.cache = kwargs.get('cache', None)
+        self.stats = kwargs.get('stats', None)
+        if not isinstance(self.stats, renderStats):
+            self.stats = renderStats(self.stats)
+        self._recorded = None
+        self._transforms = []
         if self.point_queue:
             self._initQueue()
 
         # Get image if passed, or get from location
+        load_start = time.time()
         image = kwargs.get('image', False)
         if image is False:
             location = kwargs.get('location', False)
             if location is False:
                 raise ValueError('Must pass image or location')
             self.filename = location
-            self.image = Image.open(self.filename)
+            image = Image.open(self.filename)
         else:
-            self.image = image
             self.filename = ['none']
+        self.image = self._loadImage(image, kwargs.get('draft_size', None))
+        self.stats.add('load', time.time() - load_start)
+
+        # Fingerprint the source for render cache keys
+        if self.cache is not None:
+            if self.filename != ['none']:
+                with open(self.filename, 'rb') as f:
+                    self._source_digest = hashlib.sha256(f.read()).hexdigest()
+            else:
+                self._source_digest = hashlib.sha256(
+                    self.image.tobytes()).hexdigest()
+            self._source_digest += str((self.image.mode, self.image.size))
+
+        # Array and blank canvas with borders are made on first plot
+        self._build_array()
+        self.border = kwargs.get('border', 100)
+        self._dropCanvas()
+
+    @staticmethod
+    def _loadImage(image, draft_size=None):
+        """Returns image turned upright from its EXIF orientation. If
+        draft_size (a diagonal in pixels) is given, a JPEG that is not
+        yet loaded is decoded at the smallest reduced scale that keeps at
+        least that diagonal, instead of at full size"""
+
+        if draft_size is not None:
+            w, h = image.size
+            scale = min(draft_size / (w**2 + h**2)**0.5, 1)
+            image.draft(image.mode, (int(math.ceil(w * scale)),
+                                     int(math.ceil(h * scale))))
 
         # Fix orientation if image is rotated
-        if hasattr(self.image, '_getexif'):  # only present in JPEGs
+        if hasattr(image, '_getexif'):  # only present in JPEGs
             for orientation in ExifTags.TAGS.keys():
                 if ExifTags.TAGS[orientation] == 'Orientation':
                     break
-            e = self.image._getexif()       # returns None if no EXIF data
+            e = image._getexif()       # returns None if no EXIF data
             if e is not None:
                 exif = dict(e.items())
                 if orientation in exif:
                     orientation = exif[orientation]
                     if orientation == 3:
-                        self.image = self.image.transpose(Image.ROTATE_180)
+                        image = image.transpose(Image.ROTATE_180)
                     elif orientation == 6:
-                        self.image = self.image.transpose(Image.ROTATE_270)
+                        image = image.transpose(Image.ROTATE_270)
                     elif orientation == 8:
-                        self.image = self.image.transpose(Image.ROTATE_90)
+                        image = image.transpose(Image.ROTATE_90)
 
-        # Make array and blank canvas with borders
-        self._build_array()
-        self.border = kwargs.get('border', 100)
-        self._newImage(self.border)
+        return image
 
     def _build_array(self):
-        """Builds np arrays of self.images"""
+        """Sets reduce factors for self.image and drops the np arrays,
+        which are rebuilt from it when first used"""
 
-        d = (self.image.size[0]**2 + self.image.size[1]**2)**0.5
+        w, h = self._imageSize()
+        d = (w**2 + h**2)**0.5
         self.params['reduce_factor'] = max(min(self.params['reduce_factor'],
                                            d / 1000), 1)
         self.params['net_factor'] = (self.params['reduce_factor'] *
                                      self.params['increase_factor'])
+        self._array = None
+        self._array_sat = None
+
+        # Complexity maps of this array, see _makeComplexityArray
+        self._gradients = {}
+        self._complexities = {}
+
+    def _makeArrays(self):
+        """Builds the reduced np array of self.image and its summed-area
+        table"""
+
+        start = time.time()
         w = int(self.image.size[0]/self.params['reduce_factor'])
         h = int(self.image.size[1]/self.params['reduce_factor'])
         resized = self.image.resize([w, h])
-        self.array = np.array(resized).astype('float')
+        self._array = np.array(resized).astype('float32')
+
+        # Summed-area table, padded with a zero row and column so that the
+        # sum over any rectangle is four lookups (see _getColorOfPixels)
+        self._array_sat = np.zeros((h + 1, w + 1, 3))
+        self._array_sat[1:, 1:] = self._array[:, :, :3].cumsum(
+            0, dtype='float64').cumsum(1)
+        self.stats.add('build_array', time.time() - start)
+
+    @property
+    def array(self):
+        """Reduced np array of self.image, built on first use"""
+
+        if self._array is None:
+            self._makeArrays()
+        return self._array
+
+    @property
+    def array_sat(self):
+        """Summed-area table of array, built on first use"""
+
+        if self._array_sat is None:
+            self._makeArrays()
+        return self._array_sat
+
+    @property
+    def image(self):
+        """Source image, with pending crops and resizes applied"""
+
+        if self._geometry is not None:
+            box, size = self._geometry
+            self._geometry = None
+            if all(float(v).is_integer() for v in box):
+                self._image = self._image.crop(tuple(int(v) for v in box))
+                if self._image.size != size:
+                    self._image = self._image.resize(size)
+            else:
+                self._image = self._image.resize(size, box=box)
+        return self._image
+
+    @image.setter
+    def image(self, image):
+        self._image = image
+        self._geometry = None
+
+    def _imageSize(self):
+        """Returns (w, h) of image, without applying pending transforms"""
+
+        if self._geometry is not None:
+            return self._geometry[1]
+        return self._image.size
+
+    def _addGeometry(self, box=None, size=None):
+        """Records a crop to box (in current image coordinates) and then a
+        resize to size, fused with pending ones into one box of the source
+        image and an output size, so the image is resampled once"""
+
+        if self._geometry is None:
+            self._geometry = ((0, 0) + self._image.size, self._image.size)
+        (left, top, right, bottom), current = self._geometry
+        if box is not None:
+            sx = (right - left) / current[0]
+            sy = (bottom - top) / current[1]
+            left, top, right, bottom = (left + box[0] * sx, top + box[1] * sy,
+                                        left + box[2] * sx, top + box[3] * sy)
+            current = (box[2] - box[0], box[3] - box[1])
+        if size is not None:
+            current = (int(size[0]), int(size[1]))
+        self._geometry = ((left, top, right, bottom), current)
+
+    def _canvasSize(self):
+        """Returns (w, h) of the output canvas, including borders"""
+
+        w, h = self._imageSize()
+        return (w * self.params['increase_factor'] + self.border * 2,
+                h * self.params['increase_factor'] + self.border * 2)
+
+    def _dropCanvas(self):
+        """Frees the canvases after the image changed, a new one is made
+        by _readyCanvas() before the next plot"""
+
+        self.out = None
+        self.array_out = None
+        self.array_coverage = None
+        self._canvas_ready = False
+
+    def _readyCanvas(self):
+        """Makes a new canvas if there is none for the current image"""
+
+        if not self._canvas_ready:
+            self._newImage(self.border)
 
     def _newImage(self, border):
-        """Creates new blank canvas with border"""
-
-        h = self.image.size[1] * self.params['increase_factor']
-        w = self.image.size[0] * self.params['increase_factor']
-        self.out = Image.new(
-                'RGB',
-                [w + (border * 2), h + (border * 2)],
-                (255, 255, 255))
+        """Creates new blank canvas with border. With a point queue the
+        points are only drawn later, so no RGB canvas (nor numpy RGBX
+        canvas) is allocated. The coverage array stays full size"""
+
+        w, h = self._imageSize()
+        h = h * self.params['increase_factor']
+        w = w * self.params['increase_factor']
+        self._canvas_ready = True
+        if self.point_queue:
+            self.out = None
+        else:
+            self.out = Image.new(
+                    'RGB',
+                    [w + (border * 2), h + (border * 2)],
+                    (255, 255, 255))
+        self._pending = pointArray()
+        if (self.renderer == 'numpy') and not self.point_queue:
+            self.array_out = np.full(
+                [h + (border * 2), w + (border * 2), 4], 255, dtype='uint8')
+        else:
+            self.array_out = None
         if self.plot_coverage:
-            self.out_coverage = Image.new(
-                'L', 
-                [w + (border * 2), h + (border * 2)],
-                (0,))
+            self.array_coverage = np.zeros(
+                [h + (border * 2), w + (border * 2)], dtype='uint8')
+
+    @property
+    def out_coverage(self):
+        """Coverage mask as an 'L' image, built from array_coverage"""
+
+        return Image.fromarray(self.array_coverage, 'L')
 
     def print_attributes(self):
         """Prints non-hidden object parameters"""
@@ -111,24 +370,21 @@ class pointillize:
     def crop(self, aspect, resize=False, direction='height'):
         """Crops and resizes in the height dimension to match aspect ratio"""
 
-        w = self.image.size[0]
-        h = self.image.size[1]
+        w, h = self._imageSize()
         if direction == 'height':
             h_new = w * aspect[1] // aspect[0]
-            self.image = self.image.crop((0, h // 2 - h_new // 2,
-                                          w, h // 2 + h_new // 2))
+            box = (0, h // 2 - h_new // 2, w, h // 2 + h_new // 2)
         elif direction == 'width':
             w_new = h * aspect[0] // aspect[1]
-            self.image = self.image.crop((w // 2 - w_new // 2, 0,
-                                          w // 2 + w_new // 2, h))
+            box = (w // 2 - w_new // 2, 0, w // 2 + w_new // 2, h)
         else:
             raise ValueError('Invalid direction argument')
 
-        if resize:
-            self.image = self.image.resize([aspect[0], aspect[1]])
+        self._addGeometry(box, [aspect[0], aspect[1]] if resize else None)
 
+        self._transforms.append(['crop', aspect, resize, direction])
         self._build_array()
-        self._newImage(self.border)
+        self._dropCanvas()
 
     def enhance(self, kind='contrast', amount=1):
         """Multiplies kind ('contrast', 'sharpness', 'color') by amount"""
@@ -142,23 +398,23 @@ class pointillize:
         else:
             raise Exception('Invalid Type')
 
+        self._transforms.append(['enhance', kind, amount])
         self._build_array()
-        self._newImage(self.border)
+        self._dropCanvas()
 
     def resize(self, ratio, min_size):
         """Resizes by ratio, or to min diagonal size in pixels, 
         whichever is larger"""
 
-        w = self.image.size[0]
-        h = self.image.size[1]
+        w, h = self._imageSize()
         d = (h**2 + w**2)**0.5
         ratio = max(ratio, min_size / d)
 
-        self.image = self.image.resize([int(w * ratio),
-                                       int(h * ratio)])
+        self._addGeometry(size=[int(w * ratio), int(h * ratio)])
 
+        self._transforms.append(['resize', ratio, min_size])
         self._build_array()
-        self._newImage(self.border)
+        self._dropCanvas()
 
     def display(self, **kwargs):
         """Displays browser-size version of outputs, or original images
@@ -174,8 +430,9 @@ class pointillize:
         elif gradient:
             image = Image.fromarray((self.array_complexity*255).astype('uint8'))
         else:
-            image = self.out
+            image = self._outImage()
 
+        from IPython.display import display
         print(self.filename)
         ratio = 1000/(image.size[0]**2 + image.size[1]**2)**0.5
         display(image.resize(
@@ -190,22 +447,58 @@ class pointillize:
                int(loc[1]/self.params['net_factor'])]
         r = max(int(r/self.params['net_factor']),1)
 
-        left = int(max(loc[0] - r, 0))
+        left = int(min(max(loc[0] - r, 0), self.array.shape[1]))
         right = int(min(loc[0] + r, self.array.shape[1]))
-        bottom = int(max(loc[1] - r, 0))
+        bottom = int(min(max(loc[1] - r, 0), self.array.shape[0]))
         top = int(min(loc[1] + r, self.array.shape[0]))
-        x = range(left, right)
-        y = range(bottom, top)
-        if len(x) == 0 | len(y) == 0:
+        area = (right - left) * (top - bottom)
+        if (right <= left) | (top <= bottom):
             return (255, 255, 255)
-        # R = int(self.array[np.ix_(y, x, [0])].mean())
-        # G = int(self.array[np.ix_(y, x, [1])].mean())
-        # B = int(self.array[np.ix_(y, x, [2])].mean())
-        R = int(self.array[bottom:top, left:right, [0]].mean())
-        G = int(self.array[bottom:top, left:right, [1]].mean())
-        B = int(self.array[bottom:top, left:right, [2]].mean())
 
-        return (R, G, B)
+        sat = self.array_sat
+        R, G, B = (sat[top, right] - sat[bottom, right] -
+                   sat[top, left] + sat[bottom, left]) / area
+
+        return (int(R), int(G), int(B))
+
+    def _getColorOfPixels(self, locs, r):
+        """Returns n x 3 int array of RGB [0,255] average colors of the np
+        array within squares of width 2r at locations locs=[[x,y],...],
+        where r is a scalar or one radius per location. Uses the
+        summed-area table, so cost does not depend on r"""
+
+        sums, area = self._boxSums(self.array_sat, locs, r)
+
+        colors = np.full((len(area), 3), 255, dtype=int)
+        valid = area > 0
+        colors[valid] = (sums[valid] / area[valid, None]).astype(int)
+
+        return colors
+
+    def _boxSums(self, sat, locs, r):
+        """Returns (sums, areas) of the summed-area table sat (of an array
+        the size of self.array) over squares of width 2r at canvas
+        locations locs=[[x,y],...], clipped to the array"""
+
+        locs = np.asarray(locs, dtype='float').reshape(-1, 2)
+        r = np.broadcast_to(np.asarray(r, dtype='float'), len(locs))
+
+        # Redefine locations to array based on reduce factor
+        x = (locs[:, 0] / self.params['net_factor']).astype(int)
+        y = (locs[:, 1] / self.params['net_factor']).astype(int)
+        r = np.maximum((r / self.params['net_factor']).astype(int), 1)
+
+        h, w = self.array.shape[0], self.array.shape[1]
+        left = np.clip(x - r, 0, w)
+        right = np.clip(x + r, 0, w)
+        bottom = np.clip(y - r, 0, h)
+        top = np.clip(y + r, 0, h)
+        area = (right - left) * (top - bottom)
+
+        sums = (sat[top, right] - sat[bottom, right] -
+                sat[top, left] + sat[bottom, left])
+
+        return sums, area
 
     def _plotColorPoint(self, loc, r, mask=False, **kwargs):
         """Plots point at loc with size r with average color from
@@ -213,38 +506,152 @@ class pointillize:
 
         use_transparency = kwargs.get('use_transparency', False) 
         alpha_fcn = kwargs.get('alpha_fcn', lambda: 255)
-        border = self.border
-        color = self._getColorOfPixel(loc, r)
+        color = kwargs.get('color', None)
+        if color is None:
+            color = self._getColorOfPixel(loc, r)
 
         # Hacking together transparency here for now
         # TODO handle more generally
         if use_transparency:
             alpha = int(alpha_fcn())
-            self.alpha_list.append(alpha)
+            if self.debug:
+                self.alpha_list.append(alpha)
         else:
             alpha = 255
 
+        self._drawColorPoint(loc, r, color, alpha, mask)
+
+    def _drawColorPoint(self, loc, r, color, alpha=255, mask=False):
+        """Draws (or queues, or buffers) a point of given color and alpha,
+        and marks coverage if mask is True"""
+
+        if self._recorded is not None:
+            self._recorded.append(loc[0], loc[1], r, *color, alpha, mask)
+
         if self.point_queue:
             self._queueColorPoint(loc, r, color)
+        elif self.renderer == 'numpy':
+            self._pending.append(loc[0], loc[1], r, *color, alpha)
         else:
-            new_layer = Image.new('RGBA', (int(3*r), int(3*r)), (0, 0, 0, 0))
-            draw = ImageDraw.Draw(new_layer)
-            draw.ellipse((0, 0, 2*r, 2*r),
-                         color + (alpha,))
-            self.out.paste(new_layer, (border + loc[0] - int(r),
-                                       border + loc[1] - int(r)),
-                           new_layer)
-
-        # TODO ALSO MOVE THIS TO SEPARATE FUNCTION INSTEAD OF COPYPASTA
+            self._pasteColorPoint(loc, r, color, alpha)
+
         if self.plot_coverage & mask:
-            color = (255,255,255)
-            new_layer = Image.new('RGBA', (int(2*r), int(2*r)), (0, 0, 0, 0))
-            draw = ImageDraw.Draw(new_layer)
-            draw.ellipse((0, 0, 2*r, 2*r),
-                         color + (alpha,))
-            self.out_coverage.paste(new_layer, (border + loc[0] - int(r),
-                                       border + loc[1] - int(r)),
-                           new_layer)
+            self._stampCoverage(loc, r, alpha)
+
+    def _pasteColorPoint(self, loc, r, color, alpha):
+        """Draws a point onto self.out with the PIL renderer"""
+
+        border = self.border
+        new_layer = Image.new('RGBA', (int(3*r), int(3*r)), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(new_layer)
+        draw.ellipse((0, 0, 2*r, 2*r),
+                     color + (alpha,))
+        self.out.paste(new_layer, (border + loc[0] - int(r),
+                                   border + loc[1] - int(r)),
+                       new_layer)
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _getDisk(r):
+        """Returns boolean disk stencil of radius r, keeping the most
+        recently used ones, as grid radii differ for every image size"""
+
+        R = int(r)
+        y, x = np.ogrid[-R:R + 1, -R:R + 1]
+        return (x**2 + y**2) <= r**2
+
+    def _getDiskRegion(self, shape, x, y, r):
+        """Returns (rows, cols) slices and the matching part of the disk
+        stencil for a disk of radius r centered at canvas pixel x, y,
+        clipped to an array of shape, or None if it falls outside"""
+
+        disk = self._getDisk(r)
+        R = disk.shape[0] // 2
+        x, y = int(x) - R, int(y) - R
+        top, bottom = max(y, 0), min(y + disk.shape[0], shape[0])
+        left, right = max(x, 0), min(x + disk.shape[1], shape[1])
+        if (bottom <= top) | (right <= left):
+            return None
+
+        return ((slice(top, bottom), slice(left, right)),
+                disk[top - y:bottom - y, left - x:right - x])
+
+    def _stampCoverage(self, loc, r, alpha=255):
+        """Marks disk of radius r at loc as covered in array_coverage,
+        blending towards 255 by alpha like pasting a white layer"""
+
+        found = self._getDiskRegion(self.array_coverage.shape,
+                                    loc[0] + self.border,
+                                    loc[1] + self.border, r)
+        if found is None:
+            return
+
+        region = self.array_coverage[found[0]]
+        stencil = found[1]
+        if alpha >= 255:
+            region[stencil] = 255
+        else:
+            covered = region[stencil].astype(int)
+            region[stencil] = covered + (255 - covered) * int(alpha) // 255
+
+    def _flushPoints(self):
+        """Rasterizes points buffered by the numpy renderer onto the
+        canvas, and refreshes self.out from it"""
+
+        if (self.renderer != 'numpy') or (len(self._pending) == 0):
+            return
+
+        with self.stats.stage('rasterize'):
+            points = self._pending.data
+            self._pending = pointArray()
+            self._rasterize(self.array_out,
+                            points['x'] + self.border,
+                            points['y'] + self.border,
+                            points['r'], self._pointColors(points),
+                            points['alpha'])
+            self.out = Image.frombytes('RGB', self.out.size, self.array_out,
+                                       'raw', 'RGBX')
+
+    @classmethod
+    def _rasterize(cls, canvas, x, y, r, colors, alphas):
+        """Composites disks onto canvas, a uint8 h x w x 4 RGBX array, in
+        draw order, with centers x, y in canvas pixels, radii r, n x 3
+        colors and alphas [0,255] (or one alpha for all). Opaque disks
+        are written as packed 32-bit pixels, translucent ones are alpha
+        blended"""
+
+        x = np.asarray(x).astype(int)
+        y = np.asarray(y).astype(int)
+        r = np.asarray(r, dtype='float')
+        alphas = np.broadcast_to(np.asarray(alphas).astype(int), x.shape)
+        rgbx = np.full((len(x), 4), 255, dtype='uint8')
+        rgbx[:, :3] = colors
+        packed = rgbx.view('uint32')[:, 0]
+        pixels = canvas.view('uint32')[:, :, 0]
+        h, w = pixels.shape
+
+        # Clip all bounding boxes to the canvas up front, so the loop
+        # below only slices and assigns
+        R = r.astype(int)
+        top, bottom = np.maximum(y - R, 0), np.minimum(y + R + 1, h)
+        left, right = np.maximum(x - R, 0), np.minimum(x + R + 1, w)
+        boxes = zip(r.tolist(), alphas.tolist(),
+                    top.tolist(), bottom.tolist(),
+                    left.tolist(), right.tolist(),
+                    (top - y + R).tolist(), (left - x + R).tolist())
+
+        for i, (radius, alpha, t, b, l, rt, dt, dl) in enumerate(boxes):
+            if (b <= t) | (rt <= l) | (alpha <= 0):
+                continue
+            stencil = cls._getDisk(radius)[dt:dt + b - t, dl:dl + rt - l]
+            if alpha >= 255:
+                pixels[t:b, l:rt][stencil] = packed[i]
+                continue
+            region = pixels[t:b, l:rt]
+            under = region[stencil].view('uint8').reshape(-1, 4)
+            blended = (rgbx[i].astype('uint16') * alpha +
+                       under * np.uint16(255 - alpha) + 127) // 255
+            region[stencil] = blended.astype('uint8').view('uint32')[:, 0]
 
     def plotRecPoints(self, n=40, multiplier=1, fill=False):
         """Plots symmetrical array of points over an image array,
@@ -252,6 +659,7 @@ class pointillize:
         and multiplier is the ratio of the radius to the step
         and if fill is True, fills frame, otherwise leaves border"""
 
+        self._readyCanvas()
         frame_is_top = (inspect.currentframe().
                         f_back.f_code.co_name == '<module>')
         to_print = True if self.debug & frame_is_top else False
@@ -264,17 +672,22 @@ class pointillize:
         step = (w**2 + h**2)**0.5/n
         r = step*multiplier
         if fill:
-            for x in [int(x) for x in np.linspace(0, w, w // step)]:
-                for y in [int(y) for y in np.linspace(0, h, h // step)]:
-                    self._plotColorPoint([x, y], r)
-                    count+=1
+            xs = np.linspace(0, w, int(w // step)).astype(int)
+            ys = np.linspace(0, h, int(h // step)).astype(int)
         else:
-
-            for x in [int(x) for x in np.linspace(r, w - r, w // step)]:
-                for y in [int(y) for y in np.linspace(r, h - r,
-                                                      h // step)]:
-                    self._plotColorPoint([x, y], r)
-                    count+=1
+            xs = np.linspace(r, w - r, int(w // step)).astype(int)
+            ys = np.linspace(r, h - r, int(h // step)).astype(int)
+
+        # Look up all colors in one call, then plot in column order
+        locs = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1)
+        locs = locs.reshape(-1, 2)
+        colors = self._getColorOfPixels(locs, r)
+        for loc, color in zip(locs.tolist(), colors.tolist()):
+            self._plotColorPoint(loc, r, color=tuple(color))
+            count+=1
+        self.stats.add('sampling', time.time() - start)
+        self.stats.count('grid_points', count)
+        self._flushPoints()
 
         end = time.time()
         frame_is_top = (inspect.currentframe()
@@ -306,15 +719,19 @@ class pointillize:
                 R, G, B = 0, 0, 0
             return 1 - (R + G + B) / (255 * 3.0)
         else:
-            return np.random.random()
+            return self.rng.random()
 
     def _generateRandomPoints(self, n):
-        h = self.out.size[1]
-        w = self.out.size[0]
-        locations = []
-        for i in range(0, int(n)):
-            locations.append([int(random() * w), int(random() * h)])
-        return locations
+        w, h = self._canvasSize()
+        locations = self.rng.random((int(n), 2)) * [w, h]
+        return locations.astype(int).tolist()
+
+    def _randomStream(self, block=2**14):
+        """Yields uniform floats [0,1) from self.rng, generated in
+        blocks of size block rather than one scalar at a time"""
+
+        while True:
+            yield from self.rng.random(block).tolist()
     
     
     def _getRadiusFromComplexity(self, d, power, constant, min_size, complexity):
@@ -326,14 +743,29 @@ class pointillize:
         """plots random points over image, where constant is
         the portion of the diagonal for the max size of the bubble,
         and power pushes the distribution towards smaller bubbles. 
-        Min is the portion of the diagonal for the min bubble size"""
+        Min is the portion of the diagonal for the min bubble size.
+        Placement 'random' draws uniform locations until max_skips
+        consecutive misses, 'poisson' grows a variable-radius
+        Poisson-disk set from the accepted points instead"""
 
+        self._readyCanvas()
+        random = self._randomStream().__next__
         use_transparency = kwargs.get('use_transparency', False)
         alpha_fcn = kwargs.get('alpha_fcn', lambda: ((random() * 0.5)**3 * 255 * 2**3))
         use_complexity = kwargs.get('use_complexity', True)
         use_gradient = kwargs.get('use_gradient', False)
         grad_size = kwargs.get('grad_size', 20)
         grad_mult = kwargs.get('grad_mult', 1)
+        placement = kwargs.get('placement', 'random')
+        poisson_k = kwargs.get('poisson_k', 30)
+        progress = kwargs.get('progress', None)
+        progress_points = set(kwargs.get('progress_points', [1000, 10000]))
+
+        if placement not in ['random', 'poisson']:
+            raise ValueError('Invalid placement argument')
+        if (placement == 'poisson') & (not (self.use_coverage &
+                                            self.plot_coverage)):
+            raise ValueError('Poisson placement requires coverage')
 
         if use_gradient:
             self._makeComplexityArray(1, grad_size, grad_mult)
@@ -355,52 +787,216 @@ class pointillize:
         count = 0 
         points = 0
         if self.debug: 
-            self.count_list = []  
-            self.point_list = []
-            self.time_list = []
-            self.radius_list = []
-            self.complexity_list = []
-            self.alpha_list = []
-        while True:
-            count +=1
-            j+=1
-
-            if points > int(n): 
-                if to_print: print('\nWarning: max iterations reached\n')
-                break
-            if count > max_skips: 
-                break
+            self.count_list = _debugSeries()
+            self.point_list = _debugSeries()
+            self.time_list = _debugSeries()
+            self.radius_list = _debugSeries()
+            self.complexity_list = _debugSeries()
+            self.alpha_list = _debugSeries()
+        if placement == 'poisson':
+            candidates = self._generatePoissonPoints(w, h, random, poisson_k,
+                                                     max_skips)
+        kernels = self._sampleKernels(placement, locations, use_gradient,
+                                      use_transparency, d, power, constant,
+                                      min_size)
+        if kernels is not None:
+            j, points, maxed = self._plotRandomPointsKernel(
+                kernels, n, max_skips, w, h, d, constant, power, min_size,
+                progress, progress_points)
+            if maxed & to_print:
+                print('\nWarning: max iterations reached\n')
+        else:
+            r = None
+            while True:
+                count +=1
+                j+=1
 
-            if self.debug: 
-                self.count_list.append(count)
-                self.point_list.append(points)
-                self.time_list.append(time.time() - start)
+                if points > int(n): 
+                    if to_print: print('\nWarning: max iterations reached\n')
+                    break
+                if (count > max_skips) & (placement == 'random'):
+                    break
 
-            if locations is not False:
-                loc = locations[points]     #TODO, check if this is used and delete if not
-            else:
-                loc = [int(random() * w), int(random() * h)]
-            # compare with probability matrix
-            if random() < self._testProbability(loc):
-                if use_gradient:
-                    complexity = self.array_complexity[(int(loc[1]/self.params['net_factor']),
-                                                   int(loc[0]/self.params['net_factor']))]
-                else:
-                    complexity = self._getComplexityOfPixel(
-                                        self.array, loc, int(d * constant / 2), use_complexity)
-                r = self._getRadiusFromComplexity(d, power, constant, min_size, complexity)
-                self._plotColorPoint(loc, r, use_transparency=use_transparency,
-                                        alpha_fcn=alpha_fcn, mask=True)
                 if self.debug: 
-                    self.radius_list.append(r)
-                    self.complexity_list.append(complexity)
-                points +=1
-                count = 0
+                    self.count_list.append(count)
+                    self.point_list.append(points)
+                    self.time_list.append(time.time() - start)
+
+                if locations is not False:
+                    loc = locations[points]     #TODO, check if this is used and delete if not
+                elif placement == 'poisson':
+                    try:
+                        loc = candidates.send(r)
+                    except StopIteration:
+                        break
+                else:
+                    loc = [int(random() * w), int(random() * h)]
+                r = None
+                # compare with probability matrix
+                if random() < self._testProbability(loc):
+                    if use_gradient:
+                        complexity = self.array_complexity[(int(loc[1]/self.params['net_factor']),
+                                                       int(loc[0]/self.params['net_factor']))]
+                    else:
+                        complexity = self._getComplexityOfPixel(
+                                            self.array, loc, int(d * constant / 2), use_complexity)
+                    r = self._getRadiusFromComplexity(d, power, constant, min_size, complexity)
+                    self._plotColorPoint(loc, r, use_transparency=use_transparency,
+                                            alpha_fcn=alpha_fcn, mask=True)
+                    if self.debug: 
+                        self.radius_list.append(r)
+                        self.complexity_list.append(complexity)
+                    points +=1
+                    count = 0
+                    if (progress is not None) and (points in progress_points):
+                        progress(self.preview())
+        self.stats.add('sampling', time.time() - start)
+        self.stats.count('candidates', j)
+        self.stats.count('points', points)
+        self._flushPoints()
 
         end = time.time()
         if to_print:
             print('done...took %0.2f sec for %d points' % ((end - start), points))
 
+    def _sampleKernels(self, placement, locations, use_gradient,
+                       use_transparency, d, power, constant, min_size):
+        """Returns the compiled kernels module if it is available and can
+        run this plotRandomPointsComplexity exactly like the Python loop,
+        else None. It covers opaque 'random' placement from the gradient
+        complexity, with coverage, without debug series, drawn by the
+        numpy renderer or to a point queue"""
+
+        if ((self.kernel == 'python') or (placement != 'random') or
+                (locations is not False) or (not use_gradient) or
+                use_transparency or self.debug or
+                (not (self.use_coverage & self.plot_coverage)) or
+                ((self.renderer != 'numpy') & (not self.point_queue))):
+            return None
+
+        # The kernel computes radii in float32, as numpy does here for a
+        # float32 complexity array
+        radius = self._getRadiusFromComplexity(
+            d, power, constant, min_size,
+            self.array_complexity.dtype.type(0.5))
+        if not isinstance(radius, np.float32):
+            return None
+
+        return _loadKernels()
+
+    def _plotRandomPointsKernel(self, kernels, n, max_skips, w, h, d,
+                                constant, power, min_size, progress=None,
+                                progress_points=(), block=2**14):
+        """Runs the 'random' placement loop of plotRandomPointsComplexity
+        in the compiled kernel. Uniforms are drawn from self.rng in
+        blocks of the same size as _randomStream and only when needed,
+        so the points and the state of self.rng afterwards match the
+        Python loop. Returns (candidates, points, whether n was hit)"""
+
+        rand = np.empty(0)
+        pos = 0
+        state = np.zeros(6, dtype='int64')
+        out_x = np.empty(block, dtype='int32')
+        out_y = np.empty(block, dtype='int32')
+        out_r = np.empty(block, dtype='float32')
+        out_rgb = np.empty((block, 3), dtype='uint8')
+        net_factor = float(self.params['net_factor'])
+        args = (self.array_coverage, self.border, self.array_complexity,
+                self.array_sat, net_factor, float(w), float(h),
+                np.float32(d), np.float32(constant), np.float32(power),
+                np.float32(2**power), np.float32(max(d*min_size, 2)),
+                float(max_skips), int(n))
+
+        while True:
+            later = [p for p in progress_points if p > state[2]]
+            stop = min(later) if (progress is not None) and later else 0
+            pos, filled, status = kernels.sampleComplexityPoints(
+                rand, pos, state, *args, stop, out_x, out_y, out_r, out_rgb)
+            if filled:
+                points = np.zeros(filled, dtype=point_dtype)
+                points['x'] = out_x[:filled]
+                points['y'] = out_y[:filled]
+                points['r'] = out_r[:filled]
+                for i, channel in enumerate(['R', 'G', 'B']):
+                    points[channel] = out_rgb[:filled, i]
+                points['alpha'] = 255
+                points['mask'] = True
+                self._drawColorPoints(points)
+            if status == kernels.NEED:
+                rand = self.rng.random(block)
+                pos = 0
+            elif status == kernels.PAUSE:
+                progress(self.preview())
+            elif status != kernels.FULL:
+                return int(state[1]), int(state[2]), status == kernels.MAXED
+
+    def _drawColorPoints(self, points):
+        """Draws a structured array of points (point_dtype) in order, as
+        _drawColorPoint would one by one. Coverage is left to the caller"""
+
+        if self._recorded is not None:
+            self._recorded.extend(points)
+        if (not self.point_queue) and (self.renderer != 'numpy'):
+            fields = ['x', 'y', 'r', 'R', 'G', 'B', 'alpha']
+            for x, y, r, R, G, B, alpha in zip(
+                    *[points[field].tolist() for field in fields]):
+                self._pasteColorPoint([x, y], r, (R, G, B), alpha)
+            return
+        points = points.copy()
+        points['mask'] = False
+        if self.point_queue:
+            self.pointQueue.extend(points)
+        else:
+            self._pending.extend(points)
+
+    def _generatePoissonPoints(self, w, h, random, k=30, max_skips=2e3):
+        """Generates candidate locations for variable-radius Poisson-disk
+        placement (after Bridson), drawing from the uniform stream random.
+        Send back the radius of each accepted candidate, or None if
+        rejected. Candidates are drawn in the annulus r to 2r around an
+        active point, which is retired after k misses, so the stream ends
+        once the canvas is full and total work is linear in the number of
+        points plotted. Locations that are already fully covered are
+        counted as misses without being yielded, so rejections left are
+        those of partly covered pixels, at most k per active point"""
+
+        border = self.border
+        coverage = self.array_coverage
+
+        # Seed with uniform locations until one is accepted, or give up
+        # after max_skips consecutive misses
+        r = None
+        misses = 0
+        while r is None:
+            if misses > max_skips:
+                return
+            misses += 1
+            loc = [int(random() * w), int(random() * h)]
+            if coverage.item(loc[1] + border, loc[0] + border) >= 255:
+                continue
+            r = yield loc
+        active = [(loc[0], loc[1], r)]
+
+        while active:
+            i = int(random() * len(active))
+            x, y, r_active = active[i]
+            for _ in range(k):
+                theta = 2 * math.pi * random()
+                dist = r_active * (1 + random())
+                loc = [int(x + dist * math.cos(theta)),
+                       int(y + dist * math.sin(theta))]
+                if (loc[0] < 0) | (loc[0] >= w) | (loc[1] < 0) | (loc[1] >= h):
+                    continue
+                if coverage.item(loc[1] + border, loc[0] + border) >= 255:
+                    continue
+                r = yield loc
+                if r is not None:
+                    active.append((loc[0], loc[1], r))
+                    break
+            else:
+                active[i] = active[-1]
+                active.pop()
+
     def _makeMetaSettings(self):
 
         self.settings = {
@@ -427,8 +1023,11 @@ class pointillize:
         }
 
     def plot(self, setting='balanced', n=1e5, max_skips=2e3,
-             use_transparency=False, alpha_fcn=lambda: 255,):
-        """Makes plots with present settings and optional arguments"""
+             use_transparency=False, alpha_fcn=lambda: 255, progress=None):
+        """Makes plots with present settings and optional arguments.
+        If progress is given, it is called with preview() images after
+        the grid points and after the first few random points, which
+        leaves the final image unchanged"""
 
         self._makeMetaSettings()  # TODO MOVE TO INIT
 
@@ -440,31 +1039,247 @@ class pointillize:
         to_print = True if self.debug & frame_is_top else False
         start = time.time()
 
-        self.plotRecPoints(**self.settings[setting]['PlotRecPoints'])
-        self.plotRandomPointsComplexity(**self.settings[setting]['PlotPointsComplexity'])
+        # Replay the point list on a cache hit, otherwise record it
+        key = self._renderKey(setting)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            points, state = cached
+            self._replayPoints(points)
+            self.rng.bit_generator.state = state
+        else:
+            if key is not None:
+                self._recorded = pointArray()
+            self.plotRecPoints(**self.settings[setting]['PlotRecPoints'])
+            if progress is not None:
+                progress(self.preview())
+            self.plotRandomPointsComplexity(progress=progress,
+                                            **self.settings[setting]['PlotPointsComplexity'])
+            if key is not None:
+                points = self._recorded.data
+                self._recorded = None
+                self.cache.put(key, points, self.rng.bit_generator.state)
 
         if to_print: print('done in %0.2f seconds' % (time.time() - start))
+        self.stats.emit('plot', setting=setting)
+
+    def _outImage(self):
+        """Returns the output so far as an image. In queue mode, before
+        the queue is plotted, the queued points are rendered as is"""
+
+        self._flushPoints()
+        if (self.out is None) and self.point_queue:
+            return self._renderQueue(self.pointQueue.data,
+                                     self._canvasSize(), self.border, 1)
+        return self.out
+
+    def preview(self, size=550):
+        """Returns a copy of the output so far, scaled down to a diagonal
+        of at most size pixels"""
+
+        image = self._outImage()
+        w, h = image.size
+        ratio = min(size / (w**2 + h**2)**0.5, 1)
+        return image.resize([max(int(w * ratio), 1), max(int(h * ratio), 1)])
+
+    def _renderKey(self, setting):
+        """Returns render cache key for plotting setting from the current
+        state, or None if there is no cache or the render is unseeded"""
+
+        if (self.cache is None) or (self.seed is None):
+            return None
+
+        return self.cache.key(self._source_digest, self._transforms,
+                              self.params, self.border, setting,
+                              self.use_coverage, self.plot_coverage,
+                              self.rng.bit_generator.state)
+
+    def _replayPoints(self, points):
+        """Draws a recorded point list (of point_dtype) in order"""
+
+        self._readyCanvas()
+        fields = ['x', 'y', 'r', 'R', 'G', 'B', 'alpha', 'mask']
+        for x, y, r, R, G, B, alpha, mask in zip(
+                *[points[field].tolist() for field in fields]):
+            self._drawColorPoint([x, y], r, (R, G, B), alpha, mask)
+        self._flushPoints()
+
+    def reusePoints(self, points, array, threshold=0.05, **kwargs):
+        """Redraws points (of point_dtype) recorded while plotting a
+        previous image of the same size, whose reduced array was array,
+        with colors resampled from this image. Grid points (mask False)
+        are always kept, other points are dropped if their square covers
+        pixels that changed by more than threshold (portion of 255), or
+        whose complexity changed by more than complexity_threshold when
+        the previous complexity array is passed. Coverage outside the
+        disks of dropped points is marked full, so a following
+        plotRandomPointsComplexity only fills the dropped regions rather
+        than the gaps between kept points. Returns the number of points
+        kept"""
+
+        self._readyCanvas()
+        complexity = kwargs.get('complexity', None)
+        complexity_threshold = kwargs.get('complexity_threshold', 0.1)
+
+        changed = (np.abs(self.array[:, :, :3] - array[:, :, :3]).max(axis=2)
+                   > threshold * 255)
+        if complexity is not None:
+            changed |= (np.abs(self.array_complexity - complexity) >
+                        complexity_threshold)
+        h, w = changed.shape
+        sat = np.zeros((h + 1, w + 1), dtype=int)
+        sat[1:, 1:] = changed.cumsum(0).cumsum(1)
+
+        locs = np.stack([points['x'], points['y']], axis=1)
+        changes, area = self._boxSums(sat, locs, points['r'])
+        keep = (~points['mask']) | (changes == 0)
+        kept = points[keep]
+
+        # Resample all kept colors in one call, then draw them in bulk.
+        # Coverage is set once below rather than stamped per point
+        colors = self._getColorOfPixels(
+            np.stack([kept['x'], kept['y']], axis=1), kept['r'])
+        for i, channel in enumerate(['R', 'G', 'B']):
+            kept[channel] = colors[:, i]
+        self._drawColorPoints(kept)
+        self._flushPoints()
+
+        if self.plot_coverage:
+            closed = np.ones(self.array_coverage.shape, dtype=bool)
+            for x, y, r in zip(*[points[~keep][field].tolist()
+                                 for field in ['x', 'y', 'r']]):
+                found = self._getDiskRegion(closed.shape, x + self.border,
+                                            y + self.border, r)
+                if found is not None:
+                    closed[found[0]][found[1]] = False
+            self.array_coverage[closed] = 255
+
+        return len(kept)
 
     def _queueColorPoint(self, loc, r, color):
         """Builds queue of color points"""
-        self.pointQueue.append({'loc': loc, 'r': r, 'color': color})
+        self.pointQueue.append(loc[0], loc[1], r, *color)
 
     def _initQueue(self):
         """Builds new point queue"""
-        self.pointQueue = []
+        self.pointQueue = pointArray()
+
+    @staticmethod
+    def _pointColors(points):
+        """Returns n x 3 uint8 colors of a structured array of points"""
+
+        colors = np.empty((len(points), 3), dtype='uint8')
+        for i, channel in enumerate(['R', 'G', 'B']):
+            colors[:, i] = points[channel]
+        return colors
 
     def _plotQueue(self, multiplier):
-        """Plots point queue"""
-        self._newImage(self.border)
-        border = self.border
-        for point in self.pointQueue:
-            loc = point['loc']
-            r = int(point['r'] * multiplier)
-            color = point['color']
-            draw = ImageDraw.Draw(self.out)
-            draw.ellipse((border + loc[0] - r, (border + loc[1] - r),
-                          border + loc[0] + r, (border + loc[1] + r)),
-                         color + (255,))
+        """Plots point queue, with radii scaled by multiplier, onto a
+        new canvas in one vectorized pass"""
+
+        with self.stats.stage('rasterize'):
+            self.out = self._renderQueue(self.pointQueue.data,
+                                         self._canvasSize(), self.border,
+                                         multiplier)
+
+    @classmethod
+    def _renderQueue(cls, points, size, border, multiplier):
+        """Returns RGB image of given size with opaque points drawn in
+        order, radii scaled by multiplier"""
+
+        canvas = np.full([size[1], size[0], 4], 255, dtype='uint8')
+        cls._rasterize(canvas, points['x'] + border, points['y'] + border,
+                       (points['r'] * multiplier).astype(int),
+                       cls._pointColors(points), 255)
+        return Image.frombytes('RGB', size, canvas, 'raw', 'RGBX')
+
+    def save_queue(self, location):
+        """Saves point queue to location as .npy, or as .npz if the
+        location ends with that"""
+
+        self.pointQueue.save(location)
+
+    def load_queue(self, location):
+        """Loads point queue saved with save_queue()"""
+
+        self.pointQueue = pointArray.load(location)
+        self.point_queue = True
+
+    def save_tiled(self, location, multiplier=1, tile_size=1024, **kwargs):
+        """Renders the point queue tile by tile and streams the tiles to a
+        tiled TIFF (.tif/.tiff) or PNG (.png) at location, so peak memory
+        is bounded by the tile size (one row of tiles for PNG) rather than
+        the full canvas. Tiles can be rendered on a process pool with
+        workers or executor"""
+
+        workers = kwargs.get('workers', None)
+        executor = kwargs.get('executor', None)
+        compress = kwargs.get('compress', True)
+        tile_size = max(16, tile_size // 16 * 16)  # TIFF needs multiples of 16
+
+        size = self._canvasSize()
+        if location.lower().endswith(('.tif', '.tiff')):
+            writer = _tiffTileWriter(location, size, tile_size, compress)
+        elif location.lower().endswith('.png'):
+            writer = _pngStripWriter(location, size, tile_size)
+        else:
+            raise ValueError('Location must end with .tif, .tiff or .png')
+
+        tiles = self._bucketTiles(self.pointQueue.data, size, tile_size,
+                                  multiplier)
+        try:
+            if (executor is None) and ((workers or 1) <= 1):
+                for tile in tiles:
+                    writer.write_tile(_renderTile(*tile))
+            elif executor is not None:
+                for out in _imapOrdered(executor, _renderTileArgs, tiles,
+                                        2 * (workers or 2)):
+                    writer.write_tile(out)
+            else:
+                with ProcessPoolExecutor(workers) as pool:
+                    for out in _imapOrdered(pool, _renderTileArgs, tiles,
+                                            2 * workers):
+                        writer.write_tile(out)
+        finally:
+            writer.close()
+
+    def _bucketTiles(self, points, size, tile_size, multiplier):
+        """Yields (points, origin, shape, border, multiplier) for each tile
+        of the canvas in row-major order, where points are the queued
+        points whose disks reach into that tile, kept in draw order"""
+
+        w, h = size
+        cols = (w + tile_size - 1) // tile_size
+        rows = (h + tile_size - 1) // tile_size
+
+        # Tile span of every point's bounding box, clipped to the canvas
+        x = points['x'].astype(int) + self.border
+        y = points['y'].astype(int) + self.border
+        R = (points['r'] * multiplier).astype(int)
+        col0 = np.clip((x - R) // tile_size, 0, cols - 1)
+        col1 = np.clip((x + R) // tile_size, 0, cols - 1)
+        row0 = np.clip((y - R) // tile_size, 0, rows - 1)
+        row1 = np.clip((y + R) // tile_size, 0, rows - 1)
+
+        # One entry per (point, tile) pair, stably sorted by tile so that
+        # points keep their draw order within each tile
+        ncols, nrows = col1 - col0 + 1, row1 - row0 + 1
+        counts = ncols * nrows
+        index = np.repeat(np.arange(len(points)), counts)
+        k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                counts)
+        tile = ((row0[index] + k // ncols[index]) * cols +
+                col0[index] + k % ncols[index])
+        order = np.argsort(tile, kind='stable')
+        index, tile = index[order], tile[order]
+        bounds = np.searchsorted(tile, np.arange(rows * cols + 1))
+
+        for t in range(rows * cols):
+            row, col = divmod(t, cols)
+            origin = (col * tile_size, row * tile_size)
+            shape = (min(tile_size, h - origin[1]),
+                     min(tile_size, w - origin[0]))
+            yield (points[index[bounds[t]:bounds[t + 1]]], origin, shape,
+                   self.border, multiplier)
 
     def _makeComplexityArray(self, sigma1, sigma2, multiplier=.8):
 
@@ -480,8 +1295,9 @@ class pointillize:
 
     def _testProbability(self, loc):
         if self.use_coverage:
-            location = (loc[0] + self.border, loc[1] + self.border)
-            probability = max(1 - self.out_coverage.getdata().getpixel(location)/255, 0)
+            covered = self.array_coverage.item(loc[1] + self.border,
+                                               loc[0] + self.border)
+            probability = max(1 - covered/255, 0)
 
         else:
             probability = 1
@@ -556,9 +1372,11 @@ class pointillize:
         if os.path.isdir(location) is not True:
             os.makedirs(location)
 
-        self.out.save(
-            location + '/' + prefix + self.filename.split('/')[1:][0] +
-            ' - ' + suffix + '.png')
+        with self.stats.stage('encode'):
+            self._outImage().save(
+                location + '/' + prefix + self.filename.split('/')[1:][0] +
+                ' - ' + suffix + '.png')
+        self.stats.emit('save_out')
 
 
 # Subclass adding workflows and image stack (gif) handling
@@ -567,28 +1385,27 @@ class pointillizeStack(pointillize):
     """Subclass of pointillize for making stacks of images.
     Only supports single images currently"""
 
+    _frame_plan = None
+
     def __init__(self, *args, **kwargs):
 
         pointillize.__init__(self, *args, **kwargs)
 
     def new_queue(self):
-        """Builds a new set of lists for the queue"""
+        """Builds a new, empty pipelineSpec for the queue"""
 
-        self.queue = {'methods': [], 'names': [], 'args': [], 'repeats': []}
+        self.queue = pipelineSpec()
 
     def add_to_queue(self, method, args, n):
-        """Adds a new method to the queue, to be run with args, n times"""
+        """Adds a new method (or method name) to the queue, to be run with
+        args, n times"""
 
-        self.queue['methods'].append(method)
-        self.queue['names'].append(method.__name__)
-        self.queue['args'].append(args)
-        self.queue['repeats'].append(n)
+        self.queue.add(method, args, n)
 
     def print_queue(self):
         """Prints current status of the queue"""
-        for i, method in enumerate(self.queue['methods']):
-            print(self.queue['names'][i], self.queue['args']
-                  [i], self.queue['repeats'][i])
+        for name, args, n in self.queue:
+            print(name, args, n)
 
     def run_queue(self, **kwargs):
         """Runs queue, primarily for build_stacks()"""
@@ -604,61 +1421,107 @@ class pointillizeStack(pointillize):
         to_print = True if self.debug & (frame_is_top | save_steps) else False
 
         if save_steps:
-            if not dir().__contains__('self.image_stack'):
+            if not hasattr(self, 'image_stack'):
                 self.image_stack = []
+            self._frame_plan = None
 
-        for i, method in enumerate(self.queue['methods']):
-            in_kwargs = self.queue['args'][i]
-            n = self.queue['repeats'][i]
+        for name, in_kwargs, n in self.queue:
+            method = getattr(self, name)
 
             if to_print:
-                print(method.__name__ + ':', end=' ')
+                print(name + ':', end=' ')
 
             for i in range(0, n):
                 method(**in_kwargs)
                 if save_steps:
-                    self.image_stack.append(self.out.copy())
+                    self.image_stack.append(self._outImage().copy())
                 if to_print:
                     print(i + 1, end=' ')
             if to_print:
                 print("done")
 
-    def build_stacks(self, n, save_steps):
+    def build_stacks(self, n, save_steps, **kwargs):
         """Makes an image stack by running the pipeline n times,
-        saving intermediate steps if save_steps is true"""
-
+        saving intermediate steps if save_steps is true. Each run gets
+        its own random stream spawned from seed_seq. Runs can be spread
+        over a process pool with workers or executor, in which case each
+        starts from a copy of the current state, rebuilt by the worker
+        from the image and arrays in shared memory"""
+
+        workers = kwargs.get('workers', None)
+        executor = kwargs.get('executor', None)
         self.image_stack = []
+        self._frame_plan = None
+        seeds = self.seed_seq.spawn(n)
 
         to_print = True if (self.debug & save_steps is not True) else False
 
         if to_print:
             print('Building image: ', end=' ')
-        for j in range(0, n):
-            if to_print:
-                print(j + 1, end=' ')
-            self._newImage(self.border)
-            self.run_queue(save_steps=save_steps)
-            self.image_stack.append(self.out)
+        if (executor is not None) or ((workers or 1) > 1):
+            arrays, point_kwargs = self._sharedState()
+            point_kwargs.update(queue=self.point_queue, debug=self.debug,
+                                cache=self.cache)
+            if self.point_queue:
+                arrays['points'] = self.pointQueue.data
+            attributes = {name: getattr(self, name)
+                          for name in ['queue', 'filename', 'settings',
+                                       '_transforms', '_source_digest']
+                          if hasattr(self, name)}
+            with self._sharedMemory(arrays) as specs:
+                task = partial(_runSharedQueuePass, specs, point_kwargs,
+                               attributes, save_steps=save_steps)
+                for steps, out in self._mapTasks(task, seeds, workers,
+                                                 executor):
+                    self.image_stack += steps + [out]
+        else:
+            for j in range(0, n):
+                if to_print:
+                    print(j + 1, end=' ')
+                self.rng = np.random.default_rng(seeds[j])
+                self._newImage(self.border)
+                self.run_queue(save_steps=save_steps)
+                self.image_stack.append(self._outImage())
         if to_print:
             print('done')
 
     def build_multipliers(self, plot_list, **kwargs):
-        """Plots the point queue repeatedly with multipliers from list set"""
+        """Plots the point queue repeatedly with multipliers from list set.
+        Frames can be rendered on a process pool with workers or executor,
+        sharing the point queue through shared memory. If lazy is True,
+        only the plan is kept and frames are rendered one at a time by
+        iter_frames() as they are saved"""
         self.image_stack = []
+        self._frame_plan = None
 
         to_print = self.debug
         reverse = kwargs.get('reverse', True)
         reverse_list = kwargs.get('reverse_list', False)
+        workers = kwargs.get('workers', None)
+        executor = kwargs.get('executor', None)
+        lazy = kwargs.get('lazy', False)
         if reverse_list:
-            self.pointQueue = sorted(self.pointQueue, key=lambda k: k['r'])
+            points = self.pointQueue.data
+            points[:] = points[np.argsort(points['r'], kind='stable')]
+        if lazy:
+            self._frame_plan = {'multipliers': list(plot_list),
+                                'reverse': reverse, 'workers': workers,
+                                'executor': executor}
+            return
         n = len(plot_list)
         if to_print:
             print('Building image: ', end=' ')
-        for j in range(0, n):
-            if to_print:
-                print(j + 1, end=' ')
-            self._plotQueue(plot_list[j])
-            self.image_stack.append(self.out)
+        if (executor is not None) or ((workers or 1) > 1):
+            self.image_stack = self._renderQueueParallel(plot_list, workers,
+                                                         executor)
+        else:
+            for j in range(0, n):
+                if to_print:
+                    print(j + 1, end=' ')
+                self._plotQueue(plot_list[j])
+                self.image_stack.append(self.out)
+        if len(self.image_stack) > 0:
+            self.out = self.image_stack[-1]
 
         if reverse:
             self.image_stack += self.image_stack[::-1]
@@ -666,14 +1529,188 @@ class pointillizeStack(pointillize):
         if to_print:
             print('done')
 
+    def _mapTasks(self, task, items, workers, executor):
+        """Returns list of task(item) for items, in order, run on executor
+        or on a new process pool of workers"""
+
+        if executor is not None:
+            return list(executor.map(task, items))
+        with ProcessPoolExecutor(workers) as pool:
+            return list(pool.map(task, items))
+
+    @contextmanager
+    def _sharedQueue(self):
+        """Context giving a task that renders a frame for a multiplier
+        from a read-only copy of the point queue in shared memory, so the
+        queue is not pickled to every process pool task"""
+
+        from multiprocessing import shared_memory
+        points = self.pointQueue.data
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=max(points.nbytes, 1))
+        try:
+            shared = np.ndarray(points.shape, dtype=point_dtype,
+                                buffer=shm.buf)
+            shared[:] = points
+            del shared
+            yield partial(_renderQueueFrame, shm.name, len(points),
+                          self._canvasSize(), self.border)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def plot_settings(self, settings=None, **kwargs):
+        """Plots each of settings (default all presets) from the current
+        image on a process pool of workers (or executor), returning dict
+        of setting to output image. The image is reduced and its
+        complexity maps built once here, and workers read them from
+        shared memory instead of each redoing that work. Every setting
+        is drawn with this object's seed, so outputs match plot(setting)
+        on a fresh object with the same seed"""
+
+        workers = kwargs.get('workers', os.cpu_count())
+        executor = kwargs.get('executor', None)
+        self._makeMetaSettings()
+        if settings is None:
+            settings = list(self.settings.keys())
+        for setting in settings:
+            if setting not in self.settings.keys():
+                raise Exception("Invalid setting")
+
+        with self._sharedArrays(settings) as task:
+            if (executor is None) & ((workers or 1) <= 1):
+                outs = list(map(task, settings))
+            else:
+                outs = self._mapTasks(task, settings, workers, executor)
+        return {setting: Image.fromarray(out)
+                for setting, out in zip(settings, outs)}
+
+    @contextmanager
+    def _sharedArrays(self, settings):
+        """Context giving a task that plots a setting from read-only
+        copies of the image, reduced array, summed-area table and the
+        complexity map of each setting in shared memory"""
+
+        for setting in settings:
+            kwargs = self.settings[setting]['PlotPointsComplexity']
+            if kwargs.get('use_gradient', False):
+                self._makeComplexityArray(1, kwargs.get('grad_size', 20),
+                                          kwargs.get('grad_mult', 1))
+
+        arrays, point_kwargs = self._sharedState()
+        with self._sharedMemory(arrays) as specs:
+            yield partial(_plotSharedSetting, specs, point_kwargs)
+
+    def _sharedState(self):
+        """Returns the arrays (image, reduced array, summed-area table and
+        complexity maps built so far) and the pointillize kwargs that a
+        worker rebuilds a copy of this object from"""
+
+        arrays = {'image': np.asarray(self.image), 'array': self.array,
+                  'array_sat': self.array_sat}
+        arrays.update(self._complexities)
+        point_kwargs = {'reduce_factor': self.params['reduce_factor'],
+                        'increase_factor': self.params['increase_factor'],
+                        'border': self.border, 'renderer': self.renderer,
+                        'plot_coverage': self.plot_coverage,
+                        'use_coverage': self.use_coverage,
+                        'kernel': self.kernel, 'seed': self.seed_seq}
+        return arrays, point_kwargs
+
+    @staticmethod
+    @contextmanager
+    def _sharedMemory(arrays):
+        """Context giving specs, name to (shared memory name, shape,
+        dtype), of copies of arrays (a dict of name to array) in shared
+        memory, which is freed on exit"""
+
+        from multiprocessing import shared_memory
+        shms = []
+        try:
+            specs = {}
+            for name, array in arrays.items():
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(array.nbytes, 1))
+                shms.append(shm)
+                shared = np.ndarray(array.shape, dtype=array.dtype,
+                                    buffer=shm.buf)
+                shared[:] = array
+                del shared
+                specs[name] = (shm.name, array.shape, array.dtype)
+            yield specs
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    def _renderQueueParallel(self, plot_list, workers, executor):
+        """Renders the point queue once per multiplier in plot_list on a
+        process pool"""
+
+        with self._sharedQueue() as task:
+            return self._mapTasks(task, plot_list, workers, executor)
+
+    def iter_frames(self):
+        """Yields the frames of the image stack in order. After a lazy
+        build_multipliers each frame is rendered when it is needed and
+        the reversed half is replayed by index, so only about one frame
+        (or one per worker) is held in memory at a time"""
+
+        plan = self._frame_plan
+        if plan is None:
+            for frame in self.image_stack:
+                yield frame
+            return
+
+        multipliers = plan['multipliers']
+        order = list(range(len(multipliers)))
+        if plan['reverse']:
+            order += order[::-1]
+        plot_list = [multipliers[i] for i in order]
+
+        workers, executor = plan['workers'], plan['executor']
+        if (executor is None) and ((workers or 1) <= 1):
+            for multiplier in plot_list:
+                yield self._renderQueue(self.pointQueue.data,
+                                        self._canvasSize(), self.border,
+                                        multiplier)
+            return
+
+        with self._sharedQueue() as task:
+            if executor is not None:
+                yield from _imapOrdered(executor, task, plot_list,
+                                        2 * (workers or 2))
+                return
+            with ProcessPoolExecutor(workers) as pool:
+                yield from _imapOrdered(pool, task, plot_list, 2 * workers)
+
+    def _writeFrames(self, writer):
+        """Appends frames from iter_frames() to an imageio writer one at
+        a time, then closes it"""
+
+        try:
+            for frame in self.iter_frames():
+                start = time.time()
+                writer.append_data(np.asarray(frame))
+                self.stats.add('encode', time.time() - start)
+        finally:
+            writer.close()
+        self.stats.emit('save_frames')
+
     def save_gif(self, location, step_duration, **kwargs):
-        """Save a gif of the image stack with step_duration"""
+        """Save a gif of the image stack to location (a path or file
+        object) with step_duration in seconds. Frames are encoded and
+        written one at a time, see _gifStreamWriter"""
+
+        self._writeFrames(_gifStreamWriter(location, step_duration))
 
-        arrays = []
-        for out in self.image_stack:
-            arrays.append(np.array(out))
+    def save_mp4(self, location, fps=10, **kwargs):
+        """Save an mp4 of the image stack at fps, streaming frames to the
+        writer (needs the imageio ffmpeg plugin)"""
 
-        imageio.mimsave(location, arrays, format='gif', duration=step_duration)
+        import imageio
+        self._writeFrames(imageio.get_writer(location, format='mp4',
+                                             mode='I', fps=fps))
 
 
 class pointillizePile(pointillizeStack):
@@ -711,6 +1748,7 @@ class pointillizePile(pointillizeStack):
         """Displays browser-size version of outputs, or original images
         if original=True"""
 
+        from IPython.display import display
         original = kwargs.get('original', False)
         for i in range(len(self.inputs_store)):
             image = self.inputs_store[i] if original else self.outputs_store[i]
@@ -731,9 +1769,134 @@ class pointillizePile(pointillizeStack):
             self.save_out(location, **kwargs)
             self.filenames_store.append(self.filename)
             self.inputs_store.append(self.image)
-            self.outputs_store.append(self.out)
+            self.outputs_store.append(self._outImage())
         print('done....took %0.2f seconds' % (time.time()-start))
 
+    def run_pile_pool(self, location, **kwargs):
+        """Process and save files to location on a process pool of
+        workers (or executor). Each file is loaded, run through the queue
+        and saved by its worker, so outputs are not kept here. Progress
+        and per-file timing are printed as files finish, and a file that
+        fails is recorded in pile_failures without stopping the batch,
+        including one whose worker dies (on an executor passed in, which
+        cannot be rebuilt, the files left are then recorded as failed).
+        Returns list of dicts of filename, seconds and error per file"""
+
+        workers = kwargs.pop('workers', os.cpu_count())
+        executor = kwargs.pop('executor', None)
+        window = kwargs.pop('window', 2 * max(workers or 1, 1))
+
+        point_kwargs = dict(self._kwargs)
+        point_kwargs.pop('location', None)
+        tasks = ((filename, point_kwargs, self.queue, location, kwargs)
+                 for filename in self.pile_filenames)
+        if os.path.isdir(location) is not True:
+            os.makedirs(location)
+
+        self.pile_results = []
+        self.pile_failures = []
+        print('Batch processing %d images:' % len(self.pile_filenames))
+        start = time.time()
+        if executor is not None:
+            try:
+                for result in _imapOrdered(executor, _runPileFile, tasks,
+                                           window):
+                    self._recordPileResult(result, start)
+            except BrokenProcessPool as e:
+                for filename in self.pile_filenames[len(self.pile_results):]:
+                    self._recordPileResult(_pileFailure(filename, e), start)
+        elif (workers or 1) <= 1:
+            for result in map(_runPileFile, tasks):
+                self._recordPileResult(result, start)
+        else:
+            self._runPilePool(tasks, workers, window, start)
+        print('done....took %0.2f seconds, %d failed' %
+              (time.time() - start, len(self.pile_failures)))
+
+        return self.pile_results
+
+    def _runPilePool(self, tasks, workers, window, start):
+        """Runs pile tasks on a process pool of workers with at most
+        window in flight, recording results in order. If a worker dies
+        the pool breaks, so it is rebuilt and the unfinished tasks that
+        were in flight are rerun one at a time, failing only the file
+        whose worker dies again"""
+
+        tasks = iter(tasks)
+        pending = deque()
+        pool = ProcessPoolExecutor(workers)
+        try:
+            while True:
+                for task in islice(tasks, window - len(pending)):
+                    pending.append((task, pool.submit(_runPileFile, task)))
+                if not pending:
+                    break
+                try:
+                    result = pending[0][1].result()
+                except BrokenProcessPool:
+                    pool.shutdown()
+                    for task, future in pending:
+                        try:
+                            result = future.result()
+                        except BrokenProcessPool:
+                            result = _runPileFileAlone(task)
+                        self._recordPileResult(result, start)
+                    pending.clear()
+                    pool = ProcessPoolExecutor(workers)
+                    continue
+                pending.popleft()
+                self._recordPileResult(result, start)
+        finally:
+            pool.shutdown()
+
+    def _recordPileResult(self, result, start):
+        """Records and prints a pile result as it arrives"""
+
+        self.pile_results.append(result)
+        if result['error'] is not None:
+            self.pile_failures.append(result)
+            status = 'failed: ' + result['error']
+        else:
+            status = 'took %0.2f sec' % result['seconds']
+        print('%d of %d, %s %s (%0.2f min elapsed)' %
+              (len(self.pile_results), len(self.pile_filenames),
+               result['filename'], status, (time.time() - start) / 60))
+
+    def run_pile_settings(self, location, settings=None, **kwargs):
+        """Process files with each of settings and save to location with
+        the setting as suffix. Each file is loaded once and run through
+        the steps of the queue (a pipelineSpec) that are not plots, then
+        all settings are plotted from it by plot_settings on one process
+        pool of workers (or executor)"""
+
+        workers = kwargs.pop('workers', os.cpu_count())
+        executor = kwargs.pop('executor', None)
+
+        print('Batch processing image:', end=' ')
+        start = time.time()
+        if (executor is None) & ((workers or 1) > 1):
+            with ProcessPoolExecutor(workers) as pool:
+                self._runPileSettings(location, settings, pool, **kwargs)
+        else:
+            self._runPileSettings(location, settings, executor,
+                                  workers=workers, **kwargs)
+        print('done....took %0.2f seconds' % (time.time()-start))
+
+    def _runPileSettings(self, location, settings, executor, **kwargs):
+
+        workers = kwargs.pop('workers', 1)
+        for i in range(0, len(self.pile_filenames)):
+            print(i + 1, end=' ')
+            self._init_pointilize(i)
+            for name, in_kwargs, n in self.queue:
+                if not name.startswith('plot'):
+                    for _ in range(0, n):
+                        getattr(self, name)(**in_kwargs)
+            outs = self.plot_settings(settings, workers=workers,
+                                      executor=executor)
+            for setting, out in outs.items():
+                self.out = out
+                self.save_out(location, **dict(kwargs, suffix=setting))
 
     def run_pile_gifs(self, location, n, save_steps, step_duration, **kwargs):
 
@@ -765,3 +1928,854 @@ class pointillizePile(pointillizeStack):
             self.build_multipliers(multipliers, reverse=reverse)
             self.save_gif(location + '/' + self.filename.split('/')[1] +
                           ' ' + suffix + '.gif', step_duration, **kwargs)
+
+
+# Video pipeline, decodes, pointillizes and encodes frames as a stream
+
+class pointillizeVideo:
+    """Pointillizes a movie frame by frame. Frames are decoded lazily,
+    rendered on a bounded process pool and written back in order, so
+    memory does not grow with clip length and encoding starts as soon as
+    the first frame is done. With coherent=True, frames are rendered in
+    runs of keyframe frames where each frame after the first reuses the
+    points of the previous one outside the regions that changed (see
+    pointillize.reusePoints), which is cheaper and flickers less"""
+
+    def __init__(self, location, **kwargs):
+
+        self.location = location
+        self.debug = kwargs.get('debug', False)
+        self.workers = kwargs.get('workers', os.cpu_count())
+        self.coherent = kwargs.get('coherent', False)
+        self.keyframe = kwargs.get('keyframe', 24)
+        self.threshold = kwargs.get('threshold', 0.05)
+        self.complexity_threshold = kwargs.get('complexity_threshold', 0.1)
+        if self.coherent:  # each task is a run of keyframe frames
+            self.window = kwargs.get('window', max(self.workers, 1) + 1)
+        else:
+            self.window = kwargs.get('window', 2 * max(self.workers, 1))
+        self.point_kwargs = kwargs.get('point_kwargs', {'border': 0})
+        self.plots = kwargs.get('plots', [
+            ['plotRecPoints', {'n': 40, 'multiplier': 1, 'fill': True}],
+            ['plotRandomPointsComplexity', {'n': 3e4, 'constant': 0.0075,
+                                            'power': 1.5}]])
+        self.shared_locations = kwargs.get('shared_locations', False)
+        self.seed_seq = np.random.SeedSequence(kwargs.get('seed', None))
+        self.frames_done = 0
+        self.elapsed = 0
+
+    def _frameTasks(self, frames):
+        """Yields (index, frame, seed) for frames, with one seed spawned
+        per frame so each frame is reproducible on any worker. In
+        coherent mode yields (index, frames, seeds) for runs of up to
+        keyframe consecutive frames instead"""
+
+        if not self.coherent:
+            for i, frame in enumerate(frames):
+                yield i, frame, self.seed_seq.spawn(1)[0]
+            return
+
+        run = []
+        for i, frame in enumerate(frames):
+            run.append(frame)
+            if len(run) == self.keyframe:
+                yield i + 1 - len(run), run, self.seed_seq.spawn(len(run))
+                run = []
+        if run:
+            yield i + 1 - len(run), run, self.seed_seq.spawn(len(run))
+
+    def run(self, location, fps=None, max_frames=None):
+        """Pointillizes the movie and writes it to location"""
+
+        import imageio
+        reader = imageio.get_reader(self.location)
+        if fps is None:
+            fps = reader.get_meta_data()['fps']
+        frames = iter(reader)
+        if max_frames is not None:
+            frames = islice(frames, max_frames)
+
+        # Candidate locations shared by all frames, sized from the first
+        locations = None
+        if self.shared_locations:
+            first = next(frames)
+            point = pointillize(image=Image.fromarray(first),
+                                seed=self.seed_seq.spawn(1)[0],
+                                **self.point_kwargs)
+            locations = point._generateRandomPoints(self.shared_locations)
+            frames = chain([first], frames)
+
+        coherence = None
+        if self.coherent:
+            coherence = {'threshold': self.threshold,
+                         'complexity_threshold': self.complexity_threshold}
+        setup = (self.point_kwargs, self.plots, locations, coherence)
+        tasks = self._frameTasks(frames)
+        task = _pointillizeFrames if self.coherent else _pointillizeFrame
+        writer = imageio.get_writer(location, fps=fps)
+        start = time.time()
+        self.frames_done = 0
+        try:
+            if self.workers <= 1:
+                _initVideoWorker(*setup)
+                outs = map(task, tasks)
+                self._writeFrames(writer, outs, start)
+            else:
+                with ProcessPoolExecutor(self.workers,
+                                         initializer=_initVideoWorker,
+                                         initargs=setup) as pool:
+                    outs = _imapOrdered(pool, task, tasks, self.window)
+                    self._writeFrames(writer, outs, start)
+        finally:
+            writer.close()
+            reader.close()
+        self.elapsed = time.time() - start
+
+    def _writeFrames(self, writer, outs, start):
+        """Appends rendered frames to writer as they arrive, in order"""
+
+        if self.coherent:
+            outs = chain.from_iterable(outs)
+        for out in outs:
+            writer.append_data(out)
+            self.frames_done += 1
+            if self.debug:
+                print('done frame %d, elapsed time is %0.2f min' %
+                      (self.frames_done, (time.time() - start) / 60))
+
+
+# Disk-backed cache of plotted point lists
+
+class renderCache:
+    """Disk-backed cache of plotted point lists, keyed by a hash of
+    the render inputs and evicted least recently used first once the
+    directory grows past max_bytes"""
+
+    def __init__(self, location, max_bytes=2**30):
+
+        self.location = location
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if os.path.isdir(location) is not True:
+            os.makedirs(location)
+
+    def key(self, *parts):
+        """Returns hex digest of the JSON encoding of parts"""
+
+        encoded = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.location, key + '.npz')
+
+    def get(self, key):
+        """Returns (points, rng state) for key, or None on a miss"""
+
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                points = stored['points']
+                state = json.loads(str(stored['state']))
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # evicted by another process since
+        self.hits += 1
+        return points, state
+
+    def put(self, key, points, state):
+        """Stores points and the rng state after plotting them"""
+
+        path = self._path(key)
+        temp = path + '.%d.tmp' % os.getpid()
+        with open(temp, 'wb') as f:
+            np.savez(f, points=points, state=json.dumps(state))
+        os.replace(temp, path)
+        self._evict()
+
+    def _evict(self):
+        """Removes least recently used entries until under max_bytes.
+        Other processes may share the directory, so entries removed
+        meanwhile are skipped"""
+
+        entries = []
+        for file in os.listdir(self.location):
+            if file.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.location, file))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, file in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.location, file))
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # removed by another process
+            total -= size
+
+    def stats(self):
+        """Returns dict of hit/miss counts and current size on disk"""
+
+        sizes = []
+        for file in os.listdir(self.location):
+            if file.endswith('.npz'):
+                try:
+                    sizes.append(os.path.getsize(
+                        os.path.join(self.location, file)))
+                except FileNotFoundError:
+                    continue  # evicted by another process
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions, 'entries': len(sizes),
+                'bytes': sum(sizes)}
+
+
+# Declarative, picklable queue of pointillize method calls
+
+class pipelineSpec:
+    """Queue of pointillizeStack method calls, kept as [method name,
+    kwargs, repeats] steps so it can be pickled to process pools, saved
+    as JSON and replayed on any instance with run_queue(). Steps are
+    validated against the method signatures when added"""
+
+    def __init__(self, steps=None):
+
+        self.steps = []
+        for name, kwargs, repeats in (steps or []):
+            self.add(name, kwargs, repeats)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, method, kwargs=None, repeats=1):
+        """Adds a step calling method (a name, or a bound method whose
+        name is used) with kwargs, repeats times"""
+
+        name = method if isinstance(method, str) else method.__name__
+        kwargs = dict(kwargs or {})
+        found = getattr(pointillizeStack, name, None)
+        if name.startswith('_') or not callable(found):
+            raise ValueError('Invalid method %s' % name)
+        try:
+            inspect.signature(found).bind(None, **kwargs)
+        except TypeError as e:
+            raise ValueError('Invalid arguments for %s: %s' % (name, e))
+        if int(repeats) != repeats or repeats < 0:
+            raise ValueError('Invalid repeats for %s' % name)
+
+        self.steps.append([name, kwargs, int(repeats)])
+
+    def to_json(self):
+        """Returns the steps as a JSON string, with sorted keys so that
+        equal specs give equal strings (e.g. for render cache keys)"""
+
+        return json.dumps(self.steps, sort_keys=True)
+
+    @classmethod
+    def from_json(cls, encoded):
+        """Builds a pipelineSpec from to_json() output"""
+
+        return cls(json.loads(encoded))
+
+
+# Render instrumentation
+
+class renderStats:
+    """Per-stage timings (load, build_array, complexity, sampling,
+    rasterize, encode), counters and peak memory of pointillize renders.
+    If location is given, emit() appends each snapshot to it as a JSON
+    line. With the PIL renderer points are drawn while sampling, so
+    their drawing time counts towards sampling"""
+
+    def __init__(self, location=None):
+
+        self.location = location
+        self.timings = {}
+        self.calls = {}
+        self.counts = {}
+
+    def add(self, stage, seconds):
+        """Adds seconds spent in stage"""
+
+        self.timings[stage] = self.timings.get(stage, 0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    @contextmanager
+    def stage(self, stage):
+        """Context timing its body as stage"""
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def count(self, name, n=1):
+        """Adds n to counter name"""
+
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    @staticmethod
+    def peak_memory():
+        """Returns peak resident memory of this process in bytes, or
+        None where the resource module is not available"""
+
+        try:
+            import resource
+        except ImportError:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def as_dict(self):
+        """Returns dict of timings, calls, counts, rejection ratio of
+        candidate points and peak memory"""
+
+        candidates = self.counts.get('candidates', 0)
+        rejections = candidates - self.counts.get('points', 0)
+        return {'timings': dict(self.timings), 'calls': dict(self.calls),
+                'counts': dict(self.counts),
+                'rejection_ratio': (rejections / candidates
+                                    if candidates else 0),
+                'peak_memory': self.peak_memory()}
+
+    def emit(self, event, **extra):
+        """Appends a snapshot for event, with extra fields, to location
+        as a JSON line and returns it"""
+
+        record = dict(self.as_dict(), event=event, time=time.time(), **extra)
+        if self.location is not None:
+            with open(self.location, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+        return record
+
+
+class _debugSeries:
+    """List-like series of debug samples holding at most size values.
+    When full, every other value is dropped and only every stride-th
+    later value is kept, doubling stride, so a series covers the whole
+    run at a resolution bounded by size. Series appended in lockstep stay
+    aligned"""
+
+    def __init__(self, size=2**14):
+
+        self.size = size
+        self.values = []
+        self.stride = 1
+        self._skipped = 0
+
+    def append(self, value):
+        self._skipped += 1
+        if self._skipped < self.stride:
+            return
+        self._skipped = 0
+        self.values.append(value)
+        if len(self.values) >= self.size:
+            del self.values[1::2]
+            self.stride *= 2
+            self._skipped = self.stride // 2  # keep even spacing
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.values, dtype=dtype)
+
+
+# Optional compiled kernels, see pointillism_kernels
+
+_kernels = {}
+
+
+def _loadKernels():
+    """Returns the pointillism_kernels module, imported on first use, or
+    None if numba is not installed"""
+
+    if 'module' not in _kernels:
+        try:
+            import pointillism_kernels as module
+        except ImportError:
+            module = None
+        _kernels['module'] = module
+    return _kernels['module']
+
+
+# Process pool tasks, module level so they can be pickled
+
+def _renderQueueFrame(shm_name, n, size, border, multiplier):
+    """Renders one multiplier frame of a point queue in shared memory"""
+
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        points = np.ndarray((n,), dtype=point_dtype, buffer=shm.buf)
+        out = pointillize._renderQueue(points, size, border, multiplier)
+        del points
+    finally:
+        shm.close()
+    return out
+
+
+@contextmanager
+def _attachShared(specs):
+    """Context giving dict of name to array viewing the shared memory
+    named in specs (see pointillizeStack._sharedMemory). Views handed out
+    must be dropped before exit, when the memory is closed"""
+
+    from multiprocessing import shared_memory
+    shms = {name: shared_memory.SharedMemory(name=spec[0])
+            for name, spec in specs.items()}
+    arrays = {}
+    try:
+        arrays.update({name: np.ndarray(spec[1], dtype=spec[2],
+                                        buffer=shms[name].buf)
+                       for name, spec in specs.items()})
+        yield arrays
+    finally:
+        arrays.clear()
+        for shm in shms.values():
+            shm.close()
+
+
+def _sharedPoint(cls, arrays, point_kwargs):
+    """Returns a new cls built from point_kwargs and the shared arrays
+    (see pointillizeStack._sharedState), which are taken from arrays"""
+
+    image = Image.fromarray(np.array(arrays.pop('image')))
+    point = cls(image=image, **point_kwargs)
+    point._array = arrays.pop('array')
+    point._array_sat = arrays.pop('array_sat')
+    point._complexities.update(arrays)
+    return point
+
+
+def _dropShared(point):
+    """Drops every view of shared buffers held by point"""
+
+    point._build_array()
+    point.array_complexity = None
+
+
+def _plotSharedSetting(specs, point_kwargs, setting):
+    """Plots setting on a new pointillize built from the arrays in
+    shared memory named in specs, returning the output as an array"""
+
+    with _attachShared(specs) as arrays:
+        point = _sharedPoint(pointillize, arrays, point_kwargs)
+        try:
+            point.plot(setting)
+            out = np.asarray(point._outImage())
+        finally:
+            _dropShared(point)
+    return out
+
+
+def _runSharedQueuePass(specs, point_kwargs, attributes, seed,
+                        save_steps=False):
+    """Runs a queue pass (see _runQueuePass) on a new pointillizeStack
+    built from the arrays in shared memory named in specs, with the
+    attributes (queue, filename, ...) of the stack it copies"""
+
+    with _attachShared(specs) as arrays:
+        points = arrays.pop('points', None)
+        point = _sharedPoint(pointillizeStack, arrays, point_kwargs)
+        point.__dict__.update(attributes)
+        if points is not None:
+            point.pointQueue = pointArray.fromarray(np.array(points))
+            del points
+        try:
+            return _runQueuePass(point, seed, save_steps)
+        finally:
+            _dropShared(point)
+
+
+def _imapOrdered(executor, task, items, window):
+    """Yields task(item) for items, in order, from executor while
+    keeping at most window tasks in flight. The queue of futures doubles
+    as the reorder buffer, and stops submitting while the consumer lags"""
+
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(task, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _renderTile(points, origin, shape, border, multiplier):
+    """Renders the points of one tile, returning an h x w x 3 array"""
+
+    canvas = np.full([shape[0], shape[1], 4], 255, dtype='uint8')
+    pointillize._rasterize(canvas, points['x'] + border - origin[0],
+                           points['y'] + border - origin[1],
+                           (points['r'] * multiplier).astype(int),
+                           pointillize._pointColors(points), 255)
+    return canvas[:, :, :3]
+
+
+def _renderTileArgs(args):
+    return _renderTile(*args)
+
+
+_video_worker = {}
+
+
+def _initVideoWorker(point_kwargs, plots, locations, coherence=None):
+    """Process pool initializer, keeps the per-clip setup in the worker
+    instead of relying on module globals of the parent"""
+
+    _video_worker['point_kwargs'] = point_kwargs
+    _video_worker['plots'] = plots
+    _video_worker['locations'] = locations
+    _video_worker['coherence'] = coherence
+
+
+def _runVideoPlots(point, skip=()):
+    """Runs the plots of the video worker setup on point, except those
+    named in skip"""
+
+    for name, kwargs in _video_worker['plots']:
+        if name in skip:
+            continue
+        if ((name == 'plotRandomPointsComplexity') &
+                (_video_worker['locations'] is not None)):
+            kwargs = dict(kwargs, locations=_video_worker['locations'])
+        getattr(point, name)(**kwargs)
+
+
+def _pointillizeFrame(task):
+    """Pointillizes one (index, frame, seed) task, returning an array"""
+
+    index, frame, seed = task
+    point = pointillize(image=Image.fromarray(frame), seed=seed,
+                        **_video_worker['point_kwargs'])
+    _runVideoPlots(point)
+    return np.asarray(point._outImage())
+
+
+def _pointillizeFrames(task):
+    """Pointillizes one (index, frames, seeds) run of consecutive frames,
+    the first in full and each later one by reusing the points of the
+    previous frame outside changed regions, returning a list of arrays"""
+
+    index, frames, seeds = task
+    coherence = _video_worker['coherence']
+    gradient = None
+    for name, kwargs in _video_worker['plots']:
+        if ((name == 'plotRandomPointsComplexity') &
+                kwargs.get('use_gradient', False)):
+            gradient = (kwargs.get('grad_size', 20),
+                        kwargs.get('grad_mult', 1))
+
+    outs = []
+    previous = None
+    for frame, seed in zip(frames, seeds):
+        point = pointillize(image=Image.fromarray(frame), seed=seed,
+                            **_video_worker['point_kwargs'])
+        point._recorded = pointArray()
+        if (previous is None) or (previous[1].shape != point.array.shape):
+            _runVideoPlots(point)
+        else:
+            points, array, complexity = previous
+            if gradient is not None:
+                point._makeComplexityArray(1, *gradient)
+            point.reusePoints(points, array, complexity=complexity,
+                              **coherence)
+            _runVideoPlots(point, skip=['plotRecPoints'])
+        complexity = point.array_complexity if gradient is not None else None
+        previous = (point._recorded.data, point.array, complexity)
+        outs.append(np.asarray(point._outImage()))
+    return outs
+
+
+def _runPileFile(task):
+    """Loads one (filename, point_kwargs, queue, location, save_kwargs)
+    pile task into a new pointillizeStack, runs the queue (a
+    pipelineSpec) and saves to location. Returns dict of filename,
+    seconds and error, which is None unless the file failed"""
+
+    filename, point_kwargs, queue, location, save_kwargs = task
+    start = time.time()
+    try:
+        point = pointillizeStack(location=filename, **point_kwargs)
+        point.queue = queue
+        point.run_queue()
+        point.save_out(location, **save_kwargs)
+        error = None
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+
+    return {'filename': filename, 'seconds': time.time() - start,
+            'error': error}
+
+
+def _runPileFileAlone(task):
+    """Runs one pile task on a process pool of its own, so that a worker
+    dying fails only this file"""
+
+    try:
+        with ProcessPoolExecutor(1) as pool:
+            return pool.submit(_runPileFile, task).result()
+    except BrokenProcessPool as e:
+        return _pileFailure(task[0], e)
+
+
+def _pileFailure(filename, e):
+    """Returns the pile result of a file whose worker raised e"""
+
+    return {'filename': filename, 'seconds': 0,
+            'error': '%s: %s' % (type(e).__name__, e)}
+
+
+def _runQueuePass(point, seed, save_steps=False):
+    """Runs the queue of a pointillizeStack once with a fresh canvas and
+    random stream from seed, returning (saved steps, output image)"""
+
+    point.rng = np.random.default_rng(seed)
+    point.image_stack = []
+    point._newImage(point.border)
+    point.run_queue(save_steps=save_steps)
+    return point.image_stack, point._outImage()
+
+
+# Streaming writers for tiled and animated output
+
+class _tiffTileWriter:
+    """Writes an RGB tiled TIFF one tile at a time, in row-major order,
+    with optional deflate compression. Offsets are 32 bit, so output
+    must stay under 4 GB"""
+
+    def __init__(self, location, size, tile_size, compress=True):
+
+        self.size = size
+        self.tile_size = tile_size
+        self.compress = compress
+        self.offsets = []
+        self.counts = []
+        self.file = open(location, 'wb')
+        self.file.write(b'II' + struct.pack('<HI', 42, 0))
+
+    def write_tile(self, tile):
+        """Appends tile (h x w x 3 uint8), padded to the full tile size"""
+
+        t = self.tile_size
+        if tile.shape[:2] != (t, t):
+            padded = np.zeros((t, t, 3), dtype='uint8')
+            padded[:tile.shape[0], :tile.shape[1]] = tile
+            tile = padded
+        data = np.ascontiguousarray(tile).tobytes()
+        if self.compress:
+            data = zlib.compress(data, 6)
+        self._align()
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(data))
+        self.file.write(data)
+
+    def _align(self):
+        if self.file.tell() % 2:
+            self.file.write(b'\0')
+
+    def _writeArray(self, fmt, values):
+        self._align()
+        offset = self.file.tell()
+        self.file.write(struct.pack('<%d%s' % (len(values), fmt), *values))
+        return offset
+
+    def close(self):
+        """Writes the directory and closes the file"""
+
+        if self.file.closed:
+            return
+        n = len(self.offsets)
+        bits = self._writeArray('H', [8, 8, 8])
+        if n > 1:
+            offsets = self._writeArray('I', self.offsets)
+            counts = self._writeArray('I', self.counts)
+        else:
+            offsets, counts = (self.offsets + [0])[0], (self.counts + [0])[0]
+
+        short, long = 3, 4
+        entries = [(256, long, 1, self.size[0]),
+                   (257, long, 1, self.size[1]),
+                   (258, short, 3, bits),
+                   (259, short, 1, 8 if self.compress else 1),
+                   (262, short, 1, 2),
+                   (277, short, 1, 3),
+                   (284, short, 1, 1),
+                   (322, long, 1, self.tile_size),
+                   (323, long, 1, self.tile_size),
+                   (324, long, n, offsets),
+                   (325, long, n, counts)]
+        self._align()
+        directory = self.file.tell()
+        self.file.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, value in entries:
+            self.file.write(struct.pack('<HHII', tag, kind, count, value))
+        self.file.write(struct.pack('<I', 0))
+        self.file.seek(4)
+        self.file.write(struct.pack('<I', directory))
+        self.file.close()
+
+
+class _pngStripWriter:
+    """Writes an RGB PNG from tiles given in row-major order, holding one
+    row of tiles at a time and compressing scanlines as they complete"""
+
+    def __init__(self, location, size, tile_size):
+
+        self.size = size
+        self.tile_size = tile_size
+        self.strip = None
+        self.filled = 0
+        self.row = 0
+        self.compressor = zlib.compressobj(6)
+        self.file = open(location, 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1],
+                                         8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.file.write(struct.pack('>I', len(data)) + kind + data +
+                        struct.pack('>I', zlib.crc32(kind + data)))
+
+    def write_tile(self, tile):
+        """Adds the next tile (h x w x 3 uint8) of the current row"""
+
+        if self.strip is None:
+            self.strip = np.empty((tile.shape[0], self.size[0], 3),
+                                  dtype='uint8')
+        self.strip[:, self.filled:self.filled + tile.shape[1]] = tile
+        self.filled += tile.shape[1]
+        if self.filled < self.size[0]:
+            return
+
+        # Strip is complete, compress it with a zero filter byte per line
+        lines = np.zeros((len(self.strip), 1 + 3 * self.size[0]),
+                         dtype='uint8')
+        lines[:, 1:] = self.strip.reshape(len(self.strip), -1)
+        data = self.compressor.compress(lines.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+        self.strip = None
+        self.filled = 0
+
+    def close(self):
+        """Flushes the compressor and closes the file"""
+
+        if self.file.closed:
+            return
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.file.close()
+
+
+class _gifStreamWriter:
+    """Writes an animated GIF one frame at a time, as an imageio writer
+    would (append_data and close). Each frame is quantized to its own
+    palette, cropped to the box that changed since the previous frame
+    and written out at once, so only the previous frame is held. Pillow
+    encodes the pixels of each frame, which are then copied from the
+    single frame GIF it writes"""
+
+    def __init__(self, location, duration, loop=0):
+
+        self.delay = int(round(duration * 100))  # in 1/100 s
+        self.loop = loop
+        self.previous = None
+        self.owned = not hasattr(location, 'write')
+        self.file = open(location, 'wb') if self.owned else location
+
+    def append_data(self, array):
+        """Writes the next frame, an h x w x 3 uint8 array"""
+
+        frame = Image.fromarray(np.asarray(array)).convert('RGB')
+        if self.previous is None:
+            w, h = frame.size
+            self.file.write(b'GIF89a' + struct.pack('<HHBBB', w, h, 0, 0, 0))
+            self.file.write(b'!\xff\x0bNETSCAPE2.0' +
+                            struct.pack('<BBHB', 3, 1, self.loop, 0))
+            box = (0, 0) + frame.size
+        else:
+            box = ImageChops.difference(frame, self.previous).getbbox()
+            box = box or (0, 0, 1, 1)
+        self.previous = frame
+
+        table, flags, data = self._encodeFrame(
+            frame.crop(box).convert('P', palette=Image.ADAPTIVE))
+        self.file.write(b'!\xf9\x04' +
+                        struct.pack('<BHBB', 1 << 2, self.delay, 0, 0))
+        self.file.write(b',' + struct.pack('<HHHHB', box[0], box[1],
+                                           box[2] - box[0], box[3] - box[1],
+                                           0x80 | flags))
+        self.file.write(table + data)
+
+    @staticmethod
+    def _encodeFrame(image):
+        """Returns (color table, descriptor flags for it as a local table,
+        image data) of a P mode image, read from the single frame GIF
+        Pillow writes for it"""
+
+        out = io.BytesIO()
+        image.save(out, 'GIF')
+        data = out.getvalue()
+
+        # Global color table, then skip any extensions
+        flags, bits, pos = data[10], data[10] & 7, 13
+        table = b''
+        if flags & 0x80:
+            table = data[pos:pos + 3 * 2**(bits + 1)]
+            pos += len(table)
+        while data[pos:pos + 1] == b'!':
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+
+        # Image descriptor, with a local color table if Pillow wrote one,
+        # and the interlace flag
+        flags = data[pos + 9]
+        pos += 10
+        if flags & 0x80:
+            bits = flags & 7
+            table = data[pos:pos + 3 * 2**(bits + 1)]
+            pos += len(table)
+        interlace = flags & 0x40
+
+        # Minimum code size and data sub-blocks, up to the terminator
+        start = pos
+        pos += 1
+        while data[pos]:
+            pos += data[pos] + 1
+        return table, interlace | bits, data[start:pos + 1]
+
+    def close(self):
+        """Writes the trailer, and closes the file if it was opened here"""
+
+        if self.file is None:
+            return
+        self.file.write(b';')
+        if self.owned:
+            self.file.close()
+        self.file = None
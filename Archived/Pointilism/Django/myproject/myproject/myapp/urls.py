@@ -5,6 +5,7 @@ from myproject.myapp.views import new_guid
 from myproject.myapp.views import gallery
 from myproject.myapp.views import info
 from myproject.myapp.views import gif
+from myproject.myapp.views import job_status
 
 
 urlpatterns = [
@@ -14,4 +15,6 @@ urlpatterns = [
     url(r'^gallery/(?P<guid_id>[0-9]+)$', gallery, name='gallery'),
     url(r'^info/(?P<guid_id>[0-9]+)$', info, name='info'),
     url(r'^gif/(?P<guid_id>[0-9]+)$', gif, name='gif'),
+    url(r'^job/(?P<guid_id>[0-9]+)/(?P<job_id>[0-9]+)$', job_status,
+        name='job_status'),
 ]
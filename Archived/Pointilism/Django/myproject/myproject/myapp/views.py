@@ -1,21 +1,46 @@
 # -*- coding: utf-8 -*-
 from django.shortcuts import get_object_or_404, render
 from django.template import RequestContext
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
 from django.core.urlresolvers import reverse
+from django.core.paginator import Paginator
+from django.core.files.storage import default_storage
+from django.utils import timezone
 
 from django.views.decorators.csrf import csrf_exempt
 
 from myproject.myapp.models import Document
 from myproject.myapp.models import User
+from myproject.myapp.models import RenderJob
 from myproject.myapp.forms import DocumentForm
+from myproject.myapp.jobs import enqueue, expire_stale_jobs, preview_name
+from datetime import timedelta
 
-from myproject.myapp.pointillism import pointillize, pointillizeStack
-from PIL import Image
-import os
+PAGE_SIZE = 24
+FAILURES_SHOWN_FOR = timedelta(hours=1)
 
-import io
-from django.core.files.uploadedfile import InMemoryUploadedFile
+
+def get_page(request, documents):
+    """Returns the page of documents from the page GET parameter"""
+
+    paginator = Paginator(documents, PAGE_SIZE)
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        number = 1
+    return paginator.page(min(max(number, 1), paginator.num_pages))
+
+
+def get_jobs(user, kind):
+    """Returns the queued jobs of user of kind, after failing stale ones,
+    and the jobs that failed recently"""
+
+    jobs = user.renderjob_set.filter(kind=kind)
+    expire_stale_jobs(jobs)
+    queued = jobs.filter(status=RenderJob.QUEUED)
+    failed = jobs.filter(status=RenderJob.FAILED,
+                         updated__gte=timezone.now() - FAILURES_SHOWN_FOR)
+    return queued, failed.order_by('-id')
 
 
 def new_guid(request):
@@ -36,30 +61,17 @@ def upload(request, guid_id):
         form = DocumentForm(request.POST, request.FILES)
         if form.is_valid():
             orig_file = request.FILES['docfile']
-            orig_image = Image.open(orig_file)
-            point = pointillize(image=orig_image, reduce_factor=2)
-            # point.plotRecPoints(n=40, multiplier=1, fill=False)
-            # point.plotRandomPointsComplexity(n=2e4, constant=0.01, power=1.3)
-            point.resize(ratio=0, min_size=2200)
+            data = orig_file.read()
             setting = request.POST['setting']
-            point.plot(setting)
-            new_stringIO = io.BytesIO()
-            point.out.convert('RGB').save(new_stringIO,
-                                          orig_file.content_type.split('/')
-                                          [-1].upper())
-            new_file = InMemoryUploadedFile(new_stringIO,
-                                            u"docfile",  # change this?
-                                            (orig_file.name.split('.')[0] +
-                                             ' ' + setting  +
-                                             ' pointillized.jpg'),
-                                            orig_file.content_type,
-                                            None,
-                                            None)
-            newdoc = user.document_set.create(docfile=new_file)
-            newdoc.save()
             origdoc = user.document_set.create(docfile=orig_file)
             origdoc.save()
 
+            # Render in the background, the page polls job_status
+            enqueue(user, origdoc, data, 'image', setting,
+                    (orig_file.name.split('.')[0] + ' ' + setting +
+                     ' pointillized.jpg'),
+                    orig_file.content_type.split('/')[-1].upper())
+
             # Redirect to the document upload page after POST
             return HttpResponseRedirect(reverse('upload',
                                                 kwargs={'guid_id': user.pk}))
@@ -67,27 +79,24 @@ def upload(request, guid_id):
         form = DocumentForm()  # A empty, unbound form
 
     # Load documents for the upload page
-    all_documents = user.document_set.order_by("-id")
-    documents = []
-    for document in all_documents:
-            if document.docfile.name[-16:] == 'pointillized.jpg':
-                documents.append(document)
+    documents = get_page(request, user.document_set.filter(
+        kind=Document.IMAGE, is_render=True).order_by("-id"))
+
+    jobs, failed = get_jobs(user, 'image')
 
     # Render upload page with the documents and the form
     return render(
         request,
         'upload.html',
-        {'documents': documents, 'form': form, 'guid_id': user.pk}
+        {'documents': documents, 'jobs': jobs, 'failed': failed,
+         'form': form, 'guid_id': user.pk}
     )
 
 
 def gallery(request, guid_id):
 
-    all_documents = Document.objects.order_by("-id")
-    documents = []
-    for document in all_documents:
-        if ((document.docfile.name[-16:] == 'pointillized.jpg') & (document.gallery)):
-            documents.append(document)
+    documents = get_page(request, Document.objects.filter(
+        gallery=True, is_render=True, kind=Document.IMAGE).order_by("-id"))
 
     return render(request, 'gallery.html', {'documents': documents,
                                             'guid_id': guid_id})
@@ -107,30 +116,13 @@ def gif(request, guid_id):
         form = DocumentForm(request.POST, request.FILES)
         if form.is_valid():
             orig_file = request.FILES['docfile']
-            orig_image = Image.open(orig_file)
-            point = pointillizeStack(image=orig_image, reduce_factor=2,
-                                     border=0, queue=True)
-            point.resize(0, 550)
-            point.plot('balanced')
-            multipliers = [5, 4.5, 4, 3.5, 3, 2.6, 2.3, 2, 1.75,
-                           1.5, 1.25, 1.1, 1, 1]
-            multipliers.reverse()
-            point.build_multipliers(multipliers, reverse=True)
-            # point.save_gif('temp/' + guid_id + '_pointqueue.gif', 0.1)
-            new_gif_IO = io.BytesIO()
-            point.save_gif(new_gif_IO, 0.1)
-            new_file = InMemoryUploadedFile(new_gif_IO,
-                                            u"docfile",  # change this?
-                                            (orig_file.name.split('.')[0] +
-                                             ' pointillized.gif'),
-                                            'image/gif',
-                                            None,
-                                            None)
-            newdoc = user.document_set.create(docfile=new_file)
-            newdoc.save()
+            data = orig_file.read()
             origdoc = user.document_set.create(docfile=orig_file)
             origdoc.save()
-            # os.remove('temp/' + guid_id + '_pointqueue.gif')
+
+            # Render in the background, the page polls job_status
+            enqueue(user, origdoc, data, 'gif', '',
+                    orig_file.name.split('.')[0] + ' pointillized.gif')
 
             # Redirect to the document upload page after POST
             return HttpResponseRedirect(reverse('gif',
@@ -139,16 +131,32 @@ def gif(request, guid_id):
         form = DocumentForm()  # A empty, unbound form
 
     # Load documents for the upload page
-    all_documents = user.document_set.order_by("-id")
-    documents = []
-    for document in all_documents:
-            if (document.docfile.name[-16:] == 'pointillized.gif'):
-                documents.append(document)
+    documents = get_page(request, user.document_set.filter(
+        kind=Document.GIF, is_render=True).order_by("-id"))
+
+    jobs, failed = get_jobs(user, 'gif')
 
     # Render upload page with the documents and the form
     return render(
         request,
         'upload_to_gif.html',
-        {'documents': documents, 'form': form, 'guid_id': user.pk}
+        {'documents': documents, 'jobs': jobs, 'failed': failed,
+         'form': form, 'guid_id': user.pk}
     )
 
+
+def job_status(request, guid_id, job_id):
+
+    expire_stale_jobs(RenderJob.objects.filter(pk=job_id))
+    job = get_object_or_404(RenderJob, pk=job_id, user__pk=guid_id)
+    status = {'id': job.pk, 'kind': job.kind, 'status': job.status,
+              'error': job.error}
+    if job.result is not None:
+        status['url'] = job.result.docfile.url
+    elif job.status == RenderJob.QUEUED:
+        preview = preview_name(job.key)
+        if default_storage.exists(preview):
+            status['preview'] = default_storage.url(preview)
+
+    return JsonResponse(status)
+
@@ -0,0 +1,271 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module benchmarks the pointillism engine on synthetic and sample
+images at several diagonals, with fixed seeds. Each case runs in a fresh
+process so that peak RSS is per case, and results are stored as JSON so
+runs on different commits can be compared, e.g.
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+
+With --imports it instead measures the cold import of pointillism and
+the start up of a spawned pool worker, which is what every worker and
+web process pays before its first render.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from pointillism import _loadKernels, pointillizeStack, renderStats
+
+SETTINGS = ['uniform', 'coarse', 'balanced', 'fine', 'ultrafine']
+SIZES = [550, 2200, 6000]
+KINDS = ['plot', 'plotRecPoints', 'plotRandomPointsComplexity',
+         'build_multipliers', 'save_gif']
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'images', 'pfieffer.jpg')
+MULTIPLIERS = [3, 2, 1.5, 1]
+HEAVY = ['scipy', 'matplotlib', 'IPython', 'imageio']
+IMPORT_CODE = """
+import json, sys, time
+start = time.perf_counter()
+import pointillism
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds,
+                  'rss': pointillism.renderStats.peak_memory(),
+                  'loaded': [name for name in %r if name in sys.modules]}))
+"""
+
+
+def syntheticImage(diagonal, seed=0):
+    """Returns a 4:3 RGB image with the given diagonal, made of smooth
+    gradients and random hard-edged discs so that it has both flat and
+    complex regions"""
+
+    w, h = int(diagonal * 0.8), int(diagonal * 0.6)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:h, 0:w]
+    array = np.stack([x * 255 // w, y * 255 // h,
+                      (x + y) * 255 // (w + h)], axis=-1).astype('uint8')
+    for _ in range(40):
+        cx, cy = rng.random(2) * [w, h]
+        r = rng.random() * diagonal / 10
+        array[(x - cx)**2 + (y - cy)**2 <= r**2] = rng.integers(0, 256, 3)
+    return Image.fromarray(array)
+
+
+def sampleImage(diagonal):
+    """Returns the sample image from images/ resized to diagonal"""
+
+    image = Image.open(SAMPLE).convert('RGB')
+    w, h = image.size
+    ratio = diagonal / (w**2 + h**2)**0.5
+    return image.resize([int(w * ratio), int(h * ratio)])
+
+
+def makeCases(kinds, images, sizes, settings):
+    """Returns list of case dicts, one per combination"""
+
+    cases = []
+    for kind in kinds:
+        for source in images:
+            for size in sizes:
+                for setting in (settings if kind == 'plot' else ['balanced']):
+                    name = '%s/%s/%d/%s' % (kind, source, size, setting)
+                    cases.append({'name': name, 'kind': kind,
+                                  'image': source, 'size': size,
+                                  'setting': setting})
+    return cases
+
+
+def runCase(case, seed=0, renderer='numpy', kernel='auto'):
+    """Runs one benchmark case and returns its metrics"""
+
+    if case['image'] == 'sample':
+        image = sampleImage(case['size'])
+    else:
+        image = syntheticImage(case['size'], seed)
+    queue = case['kind'] in ['build_multipliers', 'save_gif']
+    stats = renderStats()
+    point = pointillizeStack(image=image, seed=seed, renderer=renderer,
+                             queue=queue, border=0, stats=stats,
+                             kernel=kernel)
+    point._makeMetaSettings()
+    settings = point.settings[case['setting']]
+
+    # Load the compiled kernels first, their one-off cost is reported
+    # separately from the case
+    start = time.time()
+    kernels = _loadKernels() if kernel != 'python' else None
+    if kernels is not None:
+        kernels.warm()
+    kernel_seconds = time.time() - start
+
+    start = time.time()
+    if case['kind'] == 'plotRecPoints':
+        point.plotRecPoints(**settings['PlotRecPoints'])
+    elif case['kind'] == 'plotRandomPointsComplexity':
+        point.plotRandomPointsComplexity(**settings['PlotPointsComplexity'])
+    else:
+        point.plot(case['setting'])
+    if case['kind'] == 'build_multipliers':
+        start = time.time()  # time the queue renders only
+        point.build_multipliers(MULTIPLIERS, reverse=False)
+    elif case['kind'] == 'save_gif':
+        point.build_multipliers(MULTIPLIERS, reverse=False, lazy=True)
+        start = time.time()
+        point.save_gif(io.BytesIO(), 0.1)
+    seconds = time.time() - start
+
+    result = stats.as_dict()
+    points = (result['counts'].get('points', 0) +
+              result['counts'].get('grid_points', 0))
+    if queue:  # every frame draws all points
+        points *= len(MULTIPLIERS)
+    result.update(case)
+    result.update({'seconds': seconds, 'points': points,
+                   'points_per_second': points / seconds if seconds else 0,
+                   'encode_seconds': result['timings'].get('encode', 0),
+                   'kernel_seconds': kernel_seconds})
+    return result
+
+
+def runIsolated(case, **kwargs):
+    """Runs case in a new spawned process, so its peak RSS is its own"""
+
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(runCase, case, **kwargs).result()
+
+
+def importCost(repeats=5):
+    """Returns dict of the median time to import pointillism in a new
+    interpreter, its peak RSS and the heavy modules the import loaded,
+    and the median time for a spawned pool worker to start and answer,
+    with its peak RSS"""
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    imports = [json.loads(subprocess.check_output(
+        [sys.executable, '-c', IMPORT_CODE % HEAVY], cwd=here))
+        for _ in range(repeats)]
+
+    context = multiprocessing.get_context('spawn')
+    starts = []
+    for _ in range(repeats):
+        start = time.time()
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            worker_rss = pool.submit(renderStats.peak_memory).result()
+        starts.append(time.time() - start)
+
+    return {'import_seconds': float(np.median([i['seconds'] for i in imports])),
+            'import_rss': imports[0]['rss'],
+            'loaded': imports[0]['loaded'],
+            'worker_start_seconds': float(np.median(starts)),
+            'worker_rss': worker_rss}
+
+
+def environment():
+    """Returns dict describing the commit and machine"""
+
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.time(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def compare(results, location):
+    """Prints the change in time and points per second against the
+    results stored at location, for cases present in both"""
+
+    with open(location) as f:
+        before = {result['name']: result for result in json.load(f)['results']}
+    print('\n%-55s %10s %10s' % ('case', 'time', 'pts/s'))
+    for result in results:
+        old = before.get(result['name'])
+        if old is None:
+            continue
+        print('%-55s %9.2fx %9.2fx' % (
+            result['name'], result['seconds'] / max(old['seconds'], 1e-9),
+            result['points_per_second'] /
+            max(old['points_per_second'], 1e-9)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--kinds', nargs='+', default=KINDS, choices=KINDS)
+    parser.add_argument('--images', nargs='+', default=['synthetic', 'sample'],
+                        choices=['synthetic', 'sample'])
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--settings', nargs='+', default=SETTINGS,
+                        choices=SETTINGS)
+    parser.add_argument('--renderer', default='numpy',
+                        choices=['pil', 'numpy'])
+    parser.add_argument('--kernel', default='auto',
+                        choices=['auto', 'numba', 'python'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--imports', action='store_true',
+                        help='only measure import and worker start up')
+    args = parser.parse_args()
+
+    if args.imports:
+        cost = importCost()
+        print('import %.3f s %7.1f MB, worker start %.3f s %7.1f MB, '
+              'loaded %s' % (cost['import_seconds'],
+                             (cost['import_rss'] or 0) / 2**20,
+                             cost['worker_start_seconds'],
+                             (cost['worker_rss'] or 0) / 2**20,
+                             ', '.join(cost['loaded']) or 'none'))
+        with open(args.out, 'w') as f:
+            json.dump({'environment': environment(), 'imports': cost}, f,
+                      indent=1)
+        if args.compare is not None:
+            with open(args.compare) as f:
+                before = json.load(f).get('imports')
+            if before is not None:
+                for name in ['import_seconds', 'import_rss',
+                             'worker_start_seconds', 'worker_rss']:
+                    print('%-22s %9.2fx' % (name, (cost[name] or 0) /
+                                             max(before[name] or 0, 1e-9)))
+        return
+
+    results = []
+    for case in makeCases(args.kinds, args.images, args.sizes, args.settings):
+        result = runIsolated(case, seed=args.seed, renderer=args.renderer,
+                             kernel=args.kernel)
+        results.append(result)
+        print('%-55s %8.2f s %10.0f pts/s %5.1f%% rejected %7.1f MB' % (
+            case['name'], result['seconds'], result['points_per_second'],
+            100 * result['rejection_ratio'],
+            (result['peak_memory'] or 0) / 2**20))
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(), 'seed': args.seed,
+                   'renderer': args.renderer, 'kernel': args.kernel,
+                   'results': results}, f,
+                  indent=1)
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module contains optional compiled kernels for pointillism. It needs
+numba, and is imported by pointillize on first use when available, which
+otherwise runs the same loops in Python.
+"""
+
+import math
+
+import numpy as np
+from numba import njit
+
+# Status returned by sampleComplexityPoints
+NEED = 0   # the uniform stream ran out, pass a new block
+FULL = 1   # the output buffers are full, draw them and call again
+PAUSE = 2  # points reached stop, draw them and call again
+DONE = 3   # max_skips consecutive misses
+MAXED = 4  # more than n points
+
+
+@njit(cache=True, nogil=True)
+def sampleComplexityPoints(rand, pos, state, coverage, border, complexity,
+                           sat, net_factor, w, h, d, constant, power,
+                           scale, min_r, max_skips, n, stop,
+                           out_x, out_y, out_r, out_rgb):
+    """Runs the 'random' placement loop of
+    pointillize.plotRandomPointsComplexity from rand[pos:], marking
+    coverage and writing accepted points to the out_ arrays. Radii are
+    computed in float32 as the float32 complexity array makes the Python
+    loop do. state holds (count, candidates, points, stage, x, y) between
+    calls, as the loop returns whenever it needs more input or room.
+    Returns (pos, number of points written, status)"""
+
+    count, j, points, stage, x, y = (state[0], state[1], state[2],
+                                     state[3], state[4], state[5])
+    filled = 0
+    status = DONE
+    while True:
+        if stage == 0:
+            if filled == out_x.shape[0]:
+                status = FULL
+                break
+            count += 1
+            j += 1
+            if points > n:
+                status = MAXED
+                break
+            if count > max_skips:
+                status = DONE
+                break
+            stage = 1
+        if pos == rand.shape[0]:
+            status = NEED
+            break
+        if stage == 1:
+            x = int(rand[pos] * w)
+            pos += 1
+            stage = 2
+            continue
+        if stage == 2:
+            y = int(rand[pos] * h)
+            pos += 1
+            stage = 3
+            continue
+
+        # Compare with probability from coverage
+        random = rand[pos]
+        pos += 1
+        stage = 0
+        probability = 1 - coverage[y + border, x + border] / 255
+        if not random < max(probability, 0):
+            continue
+
+        # Radius from complexity, see _getRadiusFromComplexity
+        c = complexity[int(y / net_factor), int(x / net_factor)]
+        r = np.float32(math.pow(np.float32(c / np.float32(2)), power))
+        r = np.float32(np.float32(np.float32(r * d) * constant) * scale)
+        r = np.float32(math.ceil(np.float32(r + min_r)))
+
+        # Average color of the square, see _getColorOfPixel
+        ax = int(x / net_factor)
+        ay = int(y / net_factor)
+        ar = max(int(np.float32(r / np.float32(net_factor))), 1)
+        left = min(max(ax - ar, 0), sat.shape[1] - 1)
+        right = min(ax + ar, sat.shape[1] - 1)
+        bottom = min(max(ay - ar, 0), sat.shape[0] - 1)
+        top = min(ay + ar, sat.shape[0] - 1)
+        area = (right - left) * (top - bottom)
+        for k in range(3):
+            if (right <= left) | (top <= bottom):
+                out_rgb[filled, k] = 255
+            else:
+                out_rgb[filled, k] = int(
+                    (sat[top, right, k] - sat[bottom, right, k] -
+                     sat[top, left, k] + sat[bottom, left, k]) / area)
+        out_x[filled] = x
+        out_y[filled] = y
+        out_r[filled] = r
+        filled += 1
+
+        # Mark disk as covered, see _stampCoverage
+        R = int(r)
+        for dy in range(-R, R + 1):
+            row = y + border + dy
+            if (row < 0) | (row >= coverage.shape[0]):
+                continue
+            for dx in range(-R, R + 1):
+                col = x + border + dx
+                if ((col >= 0) & (col < coverage.shape[1]) &
+                        (dx * dx + dy * dy <= r * r)):
+                    coverage[row, col] = 255
+
+        points += 1
+        count = 0
+        if points == stop:
+            status = PAUSE
+            break
+
+    state[0], state[1], state[2] = count, j, points
+    state[3], state[4], state[5] = stage, x, y
+    return pos, filled, status
+
+
+def warm():
+    """Loads (compiling on the first run) the kernels by running them on
+    tiny inputs, so the cost is not paid by the first render"""
+
+    sampleComplexityPoints(
+        np.zeros(3), 0, np.zeros(6, dtype='int64'),
+        np.zeros((2, 2), dtype='uint8'), 0, np.zeros((1, 1), dtype='float32'),
+        np.zeros((2, 2, 3)), 2.0, 2.0, 2.0, np.float32(1), np.float32(1),
+        np.float32(1), np.float32(2), np.float32(2), 1.0, 1, 0,
+        np.empty(1, dtype='int32'), np.empty(1, dtype='int32'),
+        np.empty(1, dtype='float32'), np.empty((1, 3), dtype='uint8'))
@@ -4,6 +4,10 @@
 This module is for experimenting with multiprocessing.
 """
 
+import os
+
+from pointillism import pipelineSpec, pointillizePile
+
 
 def f(list):
 
@@ -13,12 +17,24 @@ def f(list):
     point = point_object(location='images_bulk/', debug=True, increase_factor=1)
 
     # Crop and build queue
-    point.new_queue()
-    # point.add_to_queue(point.crop, {'aspect': [1920, 1080], 'resize': True}, 1)
-    point.add_to_queue(point.resize, {'ratio': 0, 'min_size': 2200}, 1)
-    point.add_to_queue(point.plot, {'setting': setting}, 1)
+    point.queue = pipelineSpec([
+        # ['crop', {'aspect': [1920, 1080], 'resize': True}, 1],
+        ['resize', {'ratio': 0, 'min_size': 2200}, 1],
+        ['plot', {'setting': setting}, 1]])
 
     # Run and save
     point.run_pile_images(location='images_bulk_out', suffix=setting)
 
     return setting
+
+
+def run_settings(location, out_location, settings=None,
+                 workers=os.cpu_count()):
+    """Renders every file in location with each of settings (default all
+    presets), decoding and preprocessing each file once instead of once
+    per setting as mapping f over settings does"""
+
+    point = pointillizePile(location=location, debug=True, increase_factor=1)
+    point.queue = pipelineSpec([
+        ['resize', {'ratio': 0, 'min_size': 2200}, 1]])
+    point.run_pile_settings(out_location, settings, workers=workers)
@@ -0,0 +1,70 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module contains the diagnostic plots of the debug series recorded
+by pointillize. It is imported by the pointillize._plot* methods when
+they are first used, so that matplotlib is not loaded with pointillism.
+"""
+
+from matplotlib import pyplot as plt
+
+
+def plotIterations(point):
+
+    f, (ax1, ax2) = plt.subplots(1, 2, sharey=True)
+    ax1.plot(point.count_list)
+    ax2.plot(point.time_list, point.count_list)
+    ax1.set_ylabel('Consecutive non-plots')
+    ax1.set_xlabel('Iteration')
+    ax2.set_xlabel('Seconds')
+    ax1.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    ax1.ticklabel_format(style='sci', axis='y', scilimits=(0,0))
+    f.set_figwidth(10)
+
+    f, (ax1, ax2) = plt.subplots(1, 2, sharey=True)
+    ax1.plot(point.point_list)
+    ax2.plot(point.time_list, point.point_list)
+    ax1.set_ylabel('Plotted points')
+    ax1.set_xlabel('Iterations')
+    ax2.set_xlabel('Seconds')
+    ax1.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    ax1.ticklabel_format(style='sci', axis='y', scilimits=(0,0))
+    f.set_figwidth(10)
+    plt.show()
+
+
+def plotBubbleSize(point):
+    f, (ax1, ax2) = plt.subplots(1, 2, sharey=True)
+    ax1.hist(point.radius_list, bins=100, orientation='horizontal')
+    ax2.plot(point.radius_list, '.', alpha=min(0.5, 3e4/len(point.point_list)))
+    ax1.set_ylabel('Radius')
+    ax1.set_xlabel('Count')
+    ax2.set_xlabel('Iteration')
+    ax1.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    ax2.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    f.set_figwidth(10)
+    plt.show()
+
+
+def plotComplexity(point):
+    f, (ax1, ax2) = plt.subplots(1, 2, sharey=True)
+    ax1.hist(point.complexity_list, bins=100, orientation='horizontal')
+    ax2.scatter(x=point.radius_list, y=point.complexity_list, s=0.5)
+    ax1.set_ylabel('Complexity')
+    ax1.set_xlabel('Count')
+    ax2.set_xlabel('Radius')
+    ax1.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    f.set_figwidth(10)
+    plt.show()
+
+
+def plotAlpha(point):
+    f, (ax1, ax2) = plt.subplots(1, 2, sharey=True)
+    ax1.hist(point.alpha_list, bins=100, orientation='horizontal')
+    ax2.plot(point.alpha_list, '.', alpha=min(0.5, 3e4/len(point.point_list)))
+    ax1.set_ylabel('Alpha')
+    ax1.set_xlabel('Count')
+    ax2.set_xlabel('Iteration')
+    ax1.ticklabel_format(style='sci', axis='x', scilimits=(0,0))
+    f.set_figwidth(10)
+    plt.show()